@@ -7,3 +7,8 @@ from pyghdet.pytorn import mcm
 from pyghdet.pytorn import spcomb
 from pyghdet.pytorn import comb_indiv
 from pyghdet.pytorn import comb_species
+from pyghdet.pytorn import comb_tree
+from pyghdet.pytorn import comb_acc
+from pyghdet.pytorn import update
+from pyghdet.sitepat import site_data
+from pyghdet.sitepat import read_sites
@@ -0,0 +1,110 @@
+# cython: boundscheck = False
+# cython: wraparound = False
+# cython: cdivision = True
+# cython: language_level = 3
+
+## The counting of the site patterns, as `phyde.HydeData._get_counts`, for
+## the two views of the sites (all the sites, and the combinations of
+## individuals without missing/ambiguous bases) in one pass.
+
+from libc.stdint cimport int64_t, uint8_t
+
+
+## the bases (A, G, C, T = 0, 1, 2, 3) of each code, as phyde
+cdef int _NBASE[16]
+cdef int _BASES[16][4]
+_NBASE[:] = [1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 3, 3, 3, 3, 4]
+_BASES[0][:] = [0, 0, 0, 0]
+_BASES[1][:] = [1, 0, 0, 0]
+_BASES[2][:] = [2, 0, 0, 0]
+_BASES[3][:] = [3, 0, 0, 0]
+_BASES[4][:] = [4, 0, 0, 0]
+_BASES[5][:] = [0, 2, 0, 0]
+_BASES[6][:] = [0, 1, 0, 0]
+_BASES[7][:] = [0, 3, 0, 0]
+_BASES[8][:] = [1, 2, 0, 0]
+_BASES[9][:] = [2, 3, 0, 0]
+_BASES[10][:] = [1, 3, 0, 0]
+_BASES[11][:] = [1, 2, 3, 0]
+_BASES[12][:] = [0, 1, 3, 0]
+_BASES[13][:] = [0, 2, 3, 0]
+_BASES[14][:] = [0, 1, 2, 0]
+_BASES[15][:] = [0, 1, 2, 3]
+
+## the counts are kept in units of 1/UNIT of a combination of individuals:
+## an ambiguous combination adds UNIT/(number of resolutions) to each of its
+## resolutions, an integer, so the counts add up exactly in any order
+UNIT = 144
+cdef int64_t _UNIT = 144
+
+
+cdef void _count_one(const uint8_t[:, ::1] mat, Py_ssize_t o, Py_ssize_t a, Py_ssize_t h, Py_ssize_t b,
+                     Py_ssize_t start, Py_ssize_t stop, int64_t *unamb, int64_t *amb,
+                     int64_t *nunamb, int64_t *namb) noexcept nogil:
+    cdef:
+        Py_ssize_t s
+        uint8_t i, j, k, l
+        int nx, x, y, z, w
+        int64_t part
+        const uint8_t *ro = &mat[o, 0]
+        const uint8_t *ra = &mat[a, 0]
+        const uint8_t *rh = &mat[h, 0]
+        const uint8_t *rb = &mat[b, 0]
+    for s in range(start, stop):
+        i = ro[s]
+        j = ra[s]
+        k = rh[s]
+        l = rb[s]
+        if (i | j | k | l) < 4:
+            nunamb[0] += 1
+            unamb[((i*4 + j)*4 + k)*4 + l] += 1
+            continue
+        ## a gap, or more than two ambiguous bases
+        if i == 4 or j == 4 or k == 4 or l == 4:
+            continue
+        if (i >= 4) + (j >= 4) + (k >= 4) + (l >= 4) > 2:
+            continue
+        namb[0] += 1
+        part = _UNIT / (_NBASE[i]*_NBASE[j]*_NBASE[k]*_NBASE[l])
+        for x in range(_NBASE[i]):
+            for y in range(_NBASE[j]):
+                for z in range(_NBASE[k]):
+                    for w in range(_NBASE[l]):
+                        amb[((_BASES[i][x]*4 + _BASES[j][y])*4 + _BASES[k][z])*4 + _BASES[l][w]] += part
+
+
+def count_quads(const uint8_t[:, ::1] mat, const int64_t[::1] rows, const int64_t[:, ::1] quads,
+                double[:, :, ::1] counts, double[:, ::1] nobs, Py_ssize_t start, Py_ssize_t stop):
+    """
+    Add the counts of the 256 combinations of the bases of the (outgroup,
+    parent1, hybrid, parent2) individuals of each quadruple over the sites
+    `start` to `stop` of `mat` to `counts` (n, 2, 256), in units of 1/UNIT,
+    and their numbers to `nobs` (n, 2): [:, 0] for all the sites and [:, 1]
+    for the combinations without missing/ambiguous bases only. The
+    individuals of the four taxa of quadruple q are
+    rows[quads[q, 0]:quads[q, 1]], ..., rows[quads[q, 6]:quads[q, 7]].
+    The GIL is released while counting.
+    """
+    cdef:
+        Py_ssize_t q, c, a, b, d, e
+        int64_t unamb[256]
+        int64_t amb[256]
+        int64_t nunamb, namb
+    for q in range(quads.shape[0]):
+        with nogil:
+            for c in range(256):
+                unamb[c] = 0
+                amb[c] = 0
+            nunamb = 0
+            namb = 0
+            for a in range(quads[q, 0], quads[q, 1]):
+                for b in range(quads[q, 2], quads[q, 3]):
+                    for d in range(quads[q, 4], quads[q, 5]):
+                        for e in range(quads[q, 6], quads[q, 7]):
+                            _count_one(mat, rows[a], rows[b], rows[d], rows[e], start, stop,
+                                       unamb, amb, &nunamb, &namb)
+            for c in range(256):
+                counts[q, 0, c] += <double>(unamb[c]*_UNIT + amb[c])
+                counts[q, 1, c] += <double>(unamb[c]*_UNIT)
+            nobs[q, 0] += <double>(nunamb + namb)
+            nobs[q, 1] += <double>nunamb
@@ -4,7 +4,10 @@ from scipy.stats import cauchy
 import phyde as hd
 import pandas as pd
 from itertools import combinations
+import heapq
+import copy
 from typing import NamedTuple
+from pyghdet import sitepat
 
 
 ## A class to keep the detailed results
@@ -16,10 +19,15 @@ class result_det(NamedTuple):
     .. code:: py
       result_det(global_pv, sig_res)  
       
+    The table of all the individual tests (`tested`) and the setup of the
+    run (`setup`, with the comb_tree under "tree" with group_by) are kept
+    for `update`.
     """
     
     p_value : float
     detailed : None
+    tested : None = None
+    setup : None = None
     __slot__ = ()
     def __repr__(self):
         return f"\np_value: {self.p_value}\n\ndetailed:\n{self.detailed}"
@@ -34,13 +42,58 @@ class result_pv(NamedTuple):
     .. code:: py
       result_pv(global_pv)  
       
+    The table of all the individual tests (`tested`) and the setup of the
+    run (`setup`, with the comb_tree under "tree" with group_by) are kept
+    for `update`.
     """
     p_value : float
+    tested : None = None
+    setup : None = None
     __slot__ = ()
     def __repr__(self):
         return f"\np_value:{self.p_value}"
 
 
+## A class to keep the result of the approximate test
+class result_approx(NamedTuple):
+    """
+    A class to hold the result of the approximate global hybrid detection
+    test on a subset of the sites: the estimated result, the band of the
+    global p-value, whether the decision at alpha is the same over the band
+    and the number of sites used.
+    
+    Example:
+    .. code:: py
+      result_approx(res, (0.01, 0.03), True, 5000)  
+      
+    """
+    estimate : None
+    p_band : None
+    stable : None
+    sites : None
+    __slot__ = ()
+    def __repr__(self):
+        return f"\nestimate:{self.estimate}\n\np-value band: {self.p_band}\nstable: {self.stable}\nsites: {self.sites}"
+
+
+## A class to keep the results with and without the ambiguous sites
+class result_both(NamedTuple):
+    """
+    A class to hold the results of the global hybrid detection test on all
+    the sites and on the sites without missing/ambiguous bases only.
+    
+    Example:
+    .. code:: py
+      result_both(res_all, res_unamb)  
+      
+    """
+    all_sites : None
+    unamb_sites : None
+    __slot__ = ()
+    def __repr__(self):
+        return f"\nall sites:{self.all_sites}\n\nunambiguous sites:{self.unamb_sites}"
+
+
 ## A function to get the combinition of species
 def spcomb(species_list, sus_species = None):
     """
@@ -213,136 +266,631 @@ def cmc(pval):
 
 
 
-## combination test for individuals
-def comb_indiv(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb = None, alpha = 0.05, remove_amb_site = False):
-    
+## making a p-value ready for cct
+def _ready_pv(p):
     """
-    Main method for testing the global null hypothesis: there is no hybrid 
-    individual in the data. It is also possible to provide a set of suspected 
-    hybrid species
-   
+    A function that replaces p-values that are exactly 0 or 1 so that they
+    can be used in the combination tests.
+    """
+    if p==0:
+        return 1e-17
+    elif p==1:
+        return 0.99
+    else:
+        return p
+
+
+
+## A class to accumulate the combination tests
+class comb_acc(object):
+    """
+    A class to combine p-values as they arrive. It keeps only the weighted
+    sum of the Cauchy statistics, the total weight, the smallest p-value and
+    the number of p-values, so the memory does not grow with the number of
+    tests. Accumulators of different batches (or processes) can be merged.
+    The `cct`, `mcm` and `cmc` methods give the same results as the
+    functions with the same names on all the p-values.
     
-    Arguments
-    ---------
- 
-        - infile         <string> : name of the DNA sequence data file.
-        - mapfile        <string> : name of the taxon map file.
-        - outgroup       <string> : name of the outgroup.
-        - nindiv            <int> : number of sampled individuals.
-        - ntaxa             <int> : number of sampled taxa/populations.
-        - nsites            <int> : number of sampled sites.
-        - sus_hyb         <string>: list of suspected hybrid species.
-        - alpha            <float>: intended level of significance.
-        - ignore_amb_sites <flag> : ignore missing/ambiguous sites.
-        
-        
-    Example(No suspected hybrid):
+    Example:
     .. code:: py
       import pyghdet as ghd
-      res = ghd.comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000)
+      acc = ghd.comb_acc()
+      acc.update([0.01,0.05,0.55])
+      acc2 = ghd.comb_acc([0.99, 0.02])
+      acc.merge(acc2)
+      acc.mcm()
       
+    """
     
-    Example(with suspected hybrid):
+    def __init__(self, pvals = None, weights = None):
+        self.count = 0
+        self.weight = 0.0
+        self.stat = 0.0
+        self.min_p = 1.0
+        self.non_numeric = False
+        self.out_of_range = False
+        self.has_zero = False
+        self.has_one = False
+        self.bad_length = False
+        self.negative_weight = False
+        if pvals is not None:
+            self.update(pvals, weights)
+    
+    def update(self, pvals, weights = None):
+        """
+        Add a batch of p-values (and their weights, 1 by default).
+        """
+        pv_arr = np.asarray(pvals)
+        if len(pv_arr) == 0:
+            return self
+        
+        ## check if there is any non-numeric values in the p-vals
+        if pv_arr.dtype.kind not in "iuf":
+            self.non_numeric = True
+            return self
+        pv_arr = pv_arr.astype(float)
+        
+        ## check the weights
+        if weights is None:
+            w_ar = np.ones(len(pv_arr))
+        elif len(weights) != len(pv_arr):
+            self.bad_length = True
+            return self
+        else:
+            w_ar = np.asarray(weights, dtype=float)
+            if (w_ar<0).any():
+                self.negative_weight = True
+        
+        ## check if all the p-vals are between 0 and 1
+        if (pv_arr<0).any() or (pv_arr>1).any():
+            self.out_of_range = True
+            return self
+        
+        self.has_zero = self.has_zero or bool((pv_arr==0).any())
+        self.has_one = self.has_one or bool((pv_arr==1).any())
+        
+        ## the cauchy statistics, very small p-values as in cct
+        small = pv_arr < 1e-16
+        with np.errstate(divide='ignore'):
+            t_ar = np.where(small, 1/(np.where(small, pv_arr, 1)*math.pi), np.tan((0.5 - pv_arr)*math.pi))
+        
+        self.count = self.count + len(pv_arr)
+        self.weight = self.weight + float(w_ar.sum())
+        self.stat = self.stat + float((w_ar*t_ar).sum())
+        self.min_p = min(self.min_p, float(pv_arr.min()))
+        return self
+    
+    def merge(self, other):
+        """
+        Add the p-values accumulated in `other`.
+        """
+        self.count = self.count + other.count
+        self.weight = self.weight + other.weight
+        self.stat = self.stat + other.stat
+        self.min_p = min(self.min_p, other.min_p)
+        for flag in ("non_numeric", "out_of_range", "has_zero", "has_one", "bad_length", "negative_weight"):
+            setattr(self, flag, getattr(self, flag) or getattr(other, flag))
+        return self
+    
+    def cct(self):
+        """
+        The global p-value of the Cauchy combination test.
+        """
+        if self.non_numeric:
+            return "Warning: The individual tests produced p-values containing non-numeric character! Failed to test the global null hypothesis"
+        if self.out_of_range:
+            return "Warning: All the individual p-values must be between 0 and 1! Failed to test the global null hypothesis"
+        if(self.has_zero and self.has_one):
+            return "Error: cannot have both 0 and 1 p-values!"
+        elif(self.has_zero):
+            print("Warning: there are p-values that are exactly zero")
+            return 0
+        elif(self.has_one):
+            print("Warning: there are p-values that are exactly one")
+            return 1
+        if self.bad_length:
+            return "Error: weights and pvlaues should be same length!"
+        if self.negative_weight:
+            return "Error: All the weights must be positive!"
+        if self.count == 0:
+            return "Error: There is no p-value to combine!"
+        
+        if self.weight > 0:
+            cct_stat = self.stat/self.weight
+        else:
+            cct_stat = 0.0
+        
+        ## calculate the p-value for the global test
+        if(cct_stat>1e+15):
+            pval = (1/cct_stat)/math.pi
+        else:
+            pval = 1 - cauchy.cdf(cct_stat)
+        
+        return(float(pval))
+    
+    def mcm(self):
+        """
+        The global p-value of the MCM test.
+        """
+        p_cct = self.cct()
+        if isinstance(p_cct, str):
+            return p_cct
+        p_min = min(1, self.count*self.min_p)
+        p_mcm = min(1, 2*min(p_cct,p_min))
+        return p_mcm
+    
+    def cmc(self):
+        """
+        The global p-value of the CMC test.
+        """
+        p_cct = self.cct()
+        if isinstance(p_cct, str):
+            return p_cct
+        p_min = min(1, self.count*self.min_p)
+        p_cmc = cct([p_cct, p_min])
+        return p_cmc
+    
+    def __repr__(self):
+        return f"\ncount: {self.count}\n\nmin_p: {self.min_p}"
+
+
+
+## A class to keep a tree of combination tests
+class comb_tree(object):
+    """
+    A class to hold a tree of combination tests. The p-values of the individual
+    tests are grouped by the hybrid ("hybrid"), by the pair of parents
+    ("parents") or by a user supplied dictionary of species to clades (the
+    clade of the hybrid is used). The p-values within each group are combined
+    with the CCT and the group p-values are combined with `method` ("cct",
+    "cmc" or "mcm") to get the global p-value. The group p-values are cached,
+    so adding or removing a taxon only recomputes the groups it touches.
+    
+    Example:
     .. code:: py
+      import phyde as hd
       import pyghdet as ghd
-      res = ghd.comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, ['sp1'])
+      dat = hd.HydeData("data.txt", "map.txt", "out", 16, 4, 50000)
+      tr = ghd.comb_tree("hybrid")
+      for sp in ['sp1', 'sp2', 'sp3']:
+          tr.add_taxon(dat, sp)
+      tr.p_value()
+      tr.remove_taxon('sp3')
+      tr.p_value()
+      
     """
     
-    ## creating hyde data file and reading the map file
-    if remove_amb_site:
-        dat = hd.HydeData(infile, mapfile, outgroup, nindiv, ntaxa, nsite, True)
-    else:
-        dat = hd.HydeData(infile, mapfile, outgroup, nindiv, ntaxa, nsite)
+    def __init__(self, group_by = "hybrid", method = "cct", sus_hyb = None, level = "species"):
+        if not isinstance(group_by, dict) and group_by not in ("hybrid", "parents"):
+            raise ValueError(f"group_by must be 'hybrid', 'parents' or a dictionary of clades, not {group_by}")
+        if method not in ("cct", "cmc", "mcm"):
+            raise ValueError(f"method must be 'cct', 'cmc' or 'mcm', not {method}")
+        self.group_by = group_by
+        self.method = method
+        self.sus_hyb = sus_hyb
+        self.level = level
+        self.taxa = []
+        self.groups = {}
+        self._group_pv = {}
+        self._global_pv = None
+        self._dirty = set()
+    
+    def _key(self, triple):
+        if self.group_by == "hybrid":
+            return triple[1]
+        elif self.group_by == "parents":
+            return tuple(sorted([triple[0], triple[2]]))
+        else:
+            return self.group_by.get(triple[1], triple[1])
+    
+    def add(self, triple, pval, indiv = None):
+        """
+        Add the p-value of the test of `triple` (parent1, hybrid, parent2).
+        For the individual level tests `indiv` is the name of the hybrid
+        individual.
+        """
+        key = self._key(triple)
+        if key not in self.groups:
+            self.groups[key] = {}
+        self.groups[key][(triple[0], triple[1], triple[2], indiv)] = _ready_pv(pval)
+        for sp in triple:
+            if sp not in self.taxa:
+                self.taxa.append(sp)
+        self._dirty.add(key)
+        self._global_pv = None
+    
+    def add_taxon(self, dat, taxon):
+        """
+        Test all the triples involving `taxon` and the taxa already in the
+        tree using the HydeData object `dat` and add them to the tree.
+        """
+        new_taxa = self.taxa + [sp for sp in [taxon] if sp not in self.taxa]
+        if self.sus_hyb == None:
+            hyb = new_taxa
+        else:
+            hyb = [sp for sp in self.sus_hyb if sp in new_taxa]
+        
+        for item in spcomb(new_taxa, hyb):
+            if taxon not in item:
+                continue
+            p1 = item[0]
+            h = item[1]
+            p2 = item[2]
+            if self.level == "indiv":
+                res1 = dat.test_individuals(p1, h, p2)
+                for ind in res1:
+                    self.add(item, res1[ind]["Pvalue"], ind)
+            else:
+                res1 = dat.test_triple(p1, h, p2)
+                self.add(item, res1["Pvalue"])
+        self.taxa = new_taxa
     
-    mapf = pd.read_csv(mapfile, delimiter='\t', header=None)
+    def remove_taxon(self, taxon):
+        """
+        Remove all the tests involving `taxon` from the tree.
+        """
+        for key in list(self.groups):
+            group = self.groups[key]
+            drop = [leaf for leaf in group if taxon in leaf[:3]]
+            if len(drop) == 0:
+                continue
+            for leaf in drop:
+                del group[leaf]
+            if len(group) == 0:
+                del self.groups[key]
+                self._group_pv.pop(key, None)
+                self._dirty.discard(key)
+            else:
+                self._dirty.add(key)
+        self.taxa = [sp for sp in self.taxa if sp != taxon]
+        self._global_pv = None
     
+    def group_p_values(self):
+        """
+        Return a dictionary with the (cached) CCT p-value of every group.
+        """
+        for key in self.groups:
+            if key in self._dirty:
+                self._group_pv[key] = _ready_pv(cct(list(self.groups[key].values())))
+        self._dirty = set()
+        return { key: self._group_pv[key] for key in self.groups }
     
-    ## get the name of all the species as list
-    species_all = list(mapf.iloc[:, 1])
+    def p_value(self):
+        """
+        Return the global p-value of the tree.
+        """
+        if self._global_pv == None:
+            pvs = list(self.group_p_values().values())
+            if len(pvs) == 0:
+                return None
+            if self.method == "cmc":
+                self._global_pv = cmc(pvs)
+            elif self.method == "mcm":
+                self._global_pv = mcm(pvs)
+            else:
+                self._global_pv = cct(pvs)
+        return self._global_pv
+    
+    def __repr__(self):
+        return f"\ngroups: {len(self.groups)}\n\np_value: {self.p_value()}"
 
-    ## remove the outgroup from the list of species
 
-    species_all = [ sp for sp in species_all if sp!= outgroup ]
 
-    ## select all the unique species
+## A function to read the map file
+def _read_taxa(mapfile):
+    """
+    A function that reads the taxon map file and returns a dictionary with
+    the list of individuals of each species, in the order of the map file.
+    """
+    mapf = pd.read_csv(mapfile, delimiter='\t', header=None, dtype=str)
+    taxa = {}
+    for ind, sp in zip(mapf.iloc[:, 0], mapf.iloc[:, 1]):
+        if sp not in taxa:
+            taxa[sp] = []
+        taxa[sp].append(ind)
+    return taxa
 
-    unq_species =[]
 
-    for sp in species_all:
-        if sp not in unq_species:
-            unq_species.append(sp)
-    
-    if sus_hyb == None:
-        comb = spcomb(unq_species, unq_species)
+## A function to get the number of sites in the data file
+def _count_sites(infile):
+    """
+    A function that returns the number of sites in the DNA sequence data
+    file, either from the header or from the first sequence.
+    """
+    with open(infile) as f:
+        line = f.readline().split()
+        if line[0].isdigit() and line[1].isdigit():
+            return int(line[1])
+        return len(line[1])
+
+
+## A function to match the triples
+def _triple_key(p1, h, p2):
+    """
+    A function that returns the key of a triple, the hybrid and the set of
+    the two parents, whatever the order of the parents.
+    """
+    return (h, frozenset((p1, p2)))
+
+
+## A function to create the hyde data
+def _read_data(infile, mapfile, outgroup, nindiv, ntaxa, nsite, remove_amb_site, nproc = 1):
+    """
+    A function that creates the HydeData object for the data file, or a
+    site_data if both ambiguous site policies are used (`remove_amb_site` is
+    "both"), in shared memory if the tests are run in `nproc` > 1 processes.
+    """
+    if nproc > 1 or remove_amb_site == "both":
+        return sitepat.read_sites(infile, mapfile, outgroup, nindiv, ntaxa, nsite,
+                                  remove_amb_site == True, shared = nproc > 1)
+    elif remove_amb_site:
+        return hd.HydeData(infile, mapfile, outgroup, nindiv, ntaxa, nsite, ignore_amb_sites = True)
     else:
-        if set(sus_hyb).issubset(unq_species):
-            comb = spcomb(unq_species, sus_hyb)
-        else:
-           return f"Error:The provided suspected hybrid/s {sus_hyb} is/are not in the list of species in the data!"
+        return hd.HydeData(infile, mapfile, outgroup, nindiv, ntaxa, nsite)
+
+
+## A function to run the individual tests
+def _test_comb(dat, comb, level, nproc = 1, both = False):
+    """
+    A function that runs the test on each triple in `comb` (the test for each
+    individual of the hybrid if `level` is "indiv") and returns the table of
+    the results, the list of the hybrid species of each row and the
+    accumulated p-values (comb_acc). With `nproc` > 1 the tests are run in
+    `nproc` processes sharing the alignment `dat`, which is released
+    afterwards. With `both` the tests on all the sites and on the unambiguous
+    sites only are done in one pass and the two results are returned.
+    """
+    tests = _run_tests(dat, comb, level, nproc, both)
     
+    if both:
+        return [ _tabulate(dat, comb, level, t) for t in tests ]
+    return _tabulate(dat, comb, level, tests)
+
+
+## A function to run the individual tests on a site_data
+def _run_tests(dat, comb, level, nproc = 1, both = False):
+    """
+    A function that runs the tests of `comb` on the site_data `dat` (in
+    `nproc` processes if `nproc` > 1, releasing the shared alignment
+    afterwards) and returns them as `site_data.test_many`. Returns None if
+    `dat` is a HydeData, whose tests are run by `_tabulate`.
+    """
+    if nproc > 1:
+        try:
+            return sitepat.test_parallel(dat, comb, level, nproc, both)
+        finally:
+            dat.close(unlink = True)
+    elif both or isinstance(dat, sitepat.site_data):
+        return dat.test_many(comb, level, both)
+    return None
+
+
+## A function to make the table of the individual tests
+def _tabulate(dat, comb, level, tests = None, top_k = None):
+    """
+    A function that makes the table of the tests of the triples in `comb`,
+    from `tests` (one dictionary per triple, as `test_individuals`) or by
+    running them on `dat`. With `top_k` only the `top_k` rows with the
+    smallest p-values (with 0 <= Gamma <= 1 if `level` is "indiv") are kept,
+    in a heap, and the table is ranked. The memory is then bounded by
+    `top_k` only when the tests are run here, one triple at a time (`tests`
+    is None).
+    """
     p_val=[]
     Z_score=[]
     gamma = []
     parent1=[]
     hybrid=[]
     parent2=[]
+    hyb_sp=[]
+    acc = comb_acc()
+    best = []
+    n = 0
     
-    for item in comb:
+    for t in range(len(comb)):
+        item = comb[t]
         p1 = item[0]
         h = item[1]
         p2 = item[2]
         
-        res1 = dat.test_individuals(p1, h, p2)
+        if tests != None:
+            res1 = tests[t]
+        elif level == "indiv":
+            res1 = dat.test_individuals(p1, h, p2)
+        else:
+            res1 = {h: dat.test_triple(p1, h, p2)}
         
-        for item in res1:
-            res_each = res1[item]
+        for ind in res1:
+            res_each = res1[ind]
+            if top_k != None:
+                _push_best(best, top_k, (p1, ind, p2, res_each["Gamma"], res_each["Zscore"],
+                                         res_each["Pvalue"]), h, n, level)
+                n = n+1
+                continue
             p_val.append(res_each["Pvalue"])
             Z_score.append(res_each["Zscore"])
             gamma.append(res_each["Gamma"])
             parent1.append(p1)
             parent2.append(p2)
-            hybrid.append(item) 
-            
-
+            hybrid.append(ind)
+            hyb_sp.append(h)
+        
+        ## making the p-values ready for cct and adding them to the global test
+        acc.update([ _ready_pv(res1[ind]["Pvalue"]) for ind in res1 ])
+    
+    ## the best rows first
+    if top_k != None:
+        best = sorted(best, reverse=True)
+        parent1, hybrid, parent2, gamma, Z_score, p_val = [ [ b[3][i] for b in best ] for i in range(6) ]
+        hyb_sp = [ b[4] for b in best ]
     
     result = pd.DataFrame(list(zip(parent1, hybrid, parent2, gamma, Z_score, p_val)),
-                          columns=["Parent1", "Hybrid", "Parent2","Gamma","Z_score", 
+                          columns=["Parent1", "Hybrid", "Parent2","Gamma", "Z_score", 
                                    "P_value"])
+    return result, hyb_sp, acc
+
 
+## A function to keep the best rows in a heap
+def _push_best(best, top_k, row, h, n, level):
+    """
+    A function that adds the `row` (Parent1, Hybrid, Parent2, Gamma, Z_score,
+    P_value) of the n-th test to the heap `best` if it is among the `top_k`
+    rows with the smallest p-values (then the largest Z-scores, then the
+    first tested); the worst row is at the top of the heap.
+    """
+    gamma, z_val, p_val = row[3], row[4], row[5]
+    if math.isnan(p_val) or math.isnan(z_val):
+        return
+    if level == "indiv" and not (gamma >= 0 and gamma <= 1):
+        return
+    item = (-p_val, z_val, -n, row, h)
+    if len(best) < top_k:
+        heapq.heappush(best, item)
+    elif item > best[0]:
+        heapq.heapreplace(best, item)
+
+
+## A function to run the global test on the individual tests
+def _finish(result, hyb_sp, setup, acc = None, tree = None):
+    """
+    A function that runs the global test on the table of the individual tests
+    (or on their p-values accumulated in `acc`, or in the comb_tree `tree`
+    with `group_by`) and returns the result of the global hybrid detection
+    test. The comb_tree is kept in the setup of the result.
+    """
+    alpha = setup["alpha"]
     
-    sig_res = result[result["P_value"]<alpha]
-    sig_res = sig_res[sig_res["Gamma"] <= 1]
-    sig_res = sig_res[sig_res["Gamma"]>= 0]
+    ## the ranked best rows, with the global p-value from all the tests
+    if setup.get("top_k") != None:
+        global_pv = acc.mcm()
+        if isinstance(global_pv, str):
+            return global_pv
+        return result_det(global_pv, result, None, setup)
+    
+    sig_res = result[result["P_value"]< alpha]
+    if setup["level"] == "indiv":
+        sig_res = sig_res[sig_res["Gamma"] <= 1]
+        sig_res = sig_res[sig_res["Gamma"]>= 0]
     
     ## making the p-value ready for cct
-    pvs = []
+    if (setup["group_by"] != None and tree == None) or (setup["group_by"] == None and acc == None):
+        pvs = [ _ready_pv(p) for p in result["P_value"].tolist() ]
     
-    for p in p_val:
-        if p==0:
-            pvs.append(1e-17)
-        else:
-            if p==1:
-                pvs.append(0.99)
-            else:
-                pvs.append(p)
     
+    ## running the mcm test, or the tree of combination tests
+    if setup["group_by"] == None:
+        if acc == None:
+            acc = comb_acc(pvs)
+        global_pv = acc.mcm()
+    else:
+        if tree == None:
+            tree = comb_tree(setup["group_by"], setup["tree_method"], setup["sus_hyb"], setup["level"])
+            _add_tests(tree, result, hyb_sp, pvs)
+        global_pv = tree.p_value()
+        setup = dict(setup, tree = tree)
     
-    ## running the mcm test
-    global_pv = mcm(pvs)
+    if isinstance(global_pv, str):
+        return global_pv
     
     
     ## returning the significant results if global null is rejected
     if global_pv <= alpha:
-        return result_det(global_pv, sig_res) 
+        return result_det(global_pv, sig_res, result, setup)
     else:
-        return result_pv(global_pv)
+        return result_pv(global_pv, result, setup)
+
+
+
+def _add_tests(tree, result, hyb_sp, pvs):
+    ## adding the tests of the table to the comb_tree
+    parent1 = result["Parent1"].tolist()
+    hybrid = result["Hybrid"].tolist()
+    parent2 = result["Parent2"].tolist()
+    for i in range(len(pvs)):
+        if tree.level == "indiv":
+            tree.add((parent1[i], hyb_sp[i], parent2[i]), pvs[i], hybrid[i])
+        else:
+            tree.add((parent1[i], hyb_sp[i], parent2[i]), pvs[i])
+
+
+
+## combination test for individuals
+def comb_indiv(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb = None, alpha = 0.05, remove_amb_site = False, group_by = None, tree_method = "cct", nproc = 1, outgroups = None, approx = None, seed = 0, pipeline = False, top_k = None):
+    
+    """
+    Main method for testing the global null hypothesis: there is no hybrid 
+    individual in the data. It is also possible to provide a set of suspected 
+    hybrid species
+   
+    
+    Arguments
+    ---------
+ 
+        - infile         <string> : name of the DNA sequence data file.
+        - mapfile        <string> : name of the taxon map file.
+        - outgroup       <string> : name of the outgroup.
+        - nindiv            <int> : number of sampled individuals.
+        - ntaxa             <int> : number of sampled taxa/populations.
+        - nsites            <int> : number of sampled sites.
+        - sus_hyb         <string>: list of suspected hybrid species.
+        - alpha            <float>: intended level of significance.
+        - ignore_amb_sites <flag> : ignore missing/ambiguous sites.
+        - group_by  <string/dict> : group the tests by "hybrid", by "parents"
+                                    or by a dictionary of species to clades
+                                    and combine them as a tree (comb_tree).
+        - tree_method     <string>: test to combine the group p-values
+                                    ("cct", "cmc" or "mcm").
+        - nproc             <int> : number of processes; with nproc > 1 the
+                                    alignment is kept in shared memory.
+        
+    With remove_amb_site = "both" the tests are done on all the sites and
+    on the sites without missing/ambiguous bases in the same pass, and both
+    results are returned (result_both).
+    
+    With a list of `outgroups` (`outgroup` is then not used) the alignment
+    is read once, the triples of every outgroup are tested in the same pass
+    and a dictionary with the result for each outgroup is returned.
+    
+    With `approx` (a number of sites) the tests are done on a random subset
+    of `approx` sites (drawn with `seed`), with the power of these sites, and
+    a bootstrap band of the global p-value is computed; the subset is doubled
+    until the decision at `alpha` is the same over the band (result_approx).
+    
+    With pipeline = True the alignment is read one block of sites at a time
+    by a thread while `nproc` threads count the site patterns of the blocks
+    already read, so reading and testing overlap. The results are the same
+    as with the whole alignment read into a site_data (nproc > 1 or "both")
+    and match the default (phyde) ones to rounding, not exactly.
+    
+    With `top_k` only the `top_k` tests with the smallest p-values (and
+    0 <= Gamma <= 1) are kept while the global test is accumulated; they are
+    returned ranked in `detailed` with the global p-value (`tested` is not
+    kept). On the default path the memory does not grow with the number of
+    tests; with nproc > 1, pipeline, outgroups, approx or "both" the tests
+    of all the triples are done before the best ones are kept.
+        
+        
+    Example(No suspected hybrid):
+    .. code:: py
+      import pyghdet as ghd
+      res = ghd.comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000)
+      
+    
+    Example(with suspected hybrid):
+    .. code:: py
+      import pyghdet as ghd
+      res = ghd.comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, ['sp1'])
+    """
+    
+    return _comb(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb, alpha,
+                 remove_amb_site, group_by, tree_method, nproc, "indiv", outgroups, approx, seed, pipeline, top_k)
 
 
 
 
 
 ## combination test for species
-def comb_species(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb = None, alpha = 0.05, remove_amb_site = False):
+def comb_species(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb = None, alpha = 0.05, remove_amb_site = False, group_by = None, tree_method = "cct", nproc = 1, outgroups = None, approx = None, seed = 0, pipeline = False, top_k = None):
     
     """
     Main method for testing the global null hypothesis: there is no hybrid 
@@ -362,6 +910,39 @@ def comb_species(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb = None
         - sus_hyb         <string>: list of suspected hybrid species.
         - alpha            <float>: intended level of significance.
         - ignore_amb_sites <flag> : ignore missing/ambiguous sites.
+        - group_by  <string/dict> : group the tests by "hybrid", by "parents"
+                                    or by a dictionary of species to clades
+                                    and combine them as a tree (comb_tree).
+        - tree_method     <string>: test to combine the group p-values
+                                    ("cct", "cmc" or "mcm").
+        - nproc             <int> : number of processes; with nproc > 1 the
+                                    alignment is kept in shared memory.
+        
+    With remove_amb_site = "both" the tests are done on all the sites and
+    on the sites without missing/ambiguous bases in the same pass, and both
+    results are returned (result_both).
+    
+    With a list of `outgroups` (`outgroup` is then not used) the alignment
+    is read once, the triples of every outgroup are tested in the same pass
+    and a dictionary with the result for each outgroup is returned.
+    
+    With `approx` (a number of sites) the tests are done on a random subset
+    of `approx` sites (drawn with `seed`), with the power of these sites, and
+    a bootstrap band of the global p-value is computed; the subset is doubled
+    until the decision at `alpha` is the same over the band (result_approx).
+    
+    With pipeline = True the alignment is read one block of sites at a time
+    by a thread while `nproc` threads count the site patterns of the blocks
+    already read, so reading and testing overlap. The results are the same
+    as with the whole alignment read into a site_data (nproc > 1 or "both")
+    and match the default (phyde) ones to rounding, not exactly.
+    
+    With `top_k` only the `top_k` tests with the smallest p-values are kept
+    while the global test is accumulated; they are returned ranked in
+    `detailed` with the global p-value (`tested` is not kept). On the
+    default path the memory does not grow with the number of tests; with
+    nproc > 1, pipeline, outgroups, approx or "both" the tests of all the
+    triples are done before the best ones are kept.
         
         
     Example(No suspected hybrid):
@@ -376,90 +957,310 @@ def comb_species(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb = None
       res = ghd.comb_species("data.txt", "map.txt", "out", 16, 4, 50000, ['sp1'])
     """
     
-    ## creating hyde data file and reading the map file
-    if remove_amb_site:
-        dat = hd.HydeData(infile, mapfile, outgroup, nindiv, ntaxa, nsite, True)
-    else:
-        dat = hd.HydeData(infile, mapfile, outgroup, nindiv, ntaxa, nsite)
+    return _comb(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb, alpha,
+                 remove_amb_site, group_by, tree_method, nproc, "species", outgroups, approx, seed, pipeline, top_k)
+
+
+
+## combination test for species or individuals
+def _comb(infile, mapfile, outgroup, nindiv, ntaxa, nsite, sus_hyb, alpha, remove_amb_site, group_by, tree_method, nproc, level, outgroups = None, approx = None, seed = 0, pipeline = False, top_k = None):
+    """
+    The body of `comb_species` (`level` is "species") and `comb_indiv`
+    (`level` is "indiv").
+    """
+    
+    if group_by != None and not isinstance(group_by, dict) and group_by not in ("hybrid", "parents"):
+        return f"Error: group_by must be 'hybrid', 'parents' or a dictionary of clades, not {group_by}!"
+    if tree_method not in ("cct", "cmc", "mcm"):
+        return f"Error: tree_method must be 'cct', 'cmc' or 'mcm', not {tree_method}!"
+    if top_k != None and (not isinstance(top_k, int) or top_k < 1 or group_by != None):
+        return "Error: top_k must be a positive integer and can not be used with group_by!"
+    if approx != None and (outgroups != None or remove_amb_site == "both" or pipeline):
+        return "Error: approx can not be used with outgroups, pipeline or remove_amb_site = 'both'!"
+    
+    taxa = _read_taxa(mapfile)
+    
+    
+    ## the triples to test for each outgroup
+    runs = {}
+    for og in ([outgroup] if outgroups == None else outgroups):
+        if og not in taxa:
+            return f"Error: The outgroup {og} is not in the map file!"
+        
+        ## select all the unique species without the outgroup
+        unq_species = [ sp for sp in taxa if sp!= og ]
+        
+        if sus_hyb == None:
+            comb = spcomb(unq_species, unq_species)
+        else:
+            comb = spcomb(unq_species, sus_hyb)
+            if isinstance(comb, str):
+                return comb
+        runs[og] = comb
+    
+    setup = {"level": level, "outgroup": outgroup, "sus_hyb": sus_hyb, "alpha": alpha,
+             "remove_amb_site": remove_amb_site, "group_by": group_by,
+             "tree_method": tree_method, "nproc": nproc, "taxa": taxa, "approx": approx, "top_k": top_k}
+    both = remove_amb_site == "both"
+    
+    if approx != None:
+        dat = sitepat.read_sites(infile, mapfile, outgroup, nindiv, ntaxa, nsite, remove_amb_site == True)
+        return _approx(dat, runs[outgroup], level, setup, approx, seed)
     
+    if outgroups == None and pipeline:
+        tests = sitepat.stream_tests(infile, mapfile, outgroup, nindiv, ntaxa, nsite, runs[outgroup],
+                                     level, remove_amb_site == True, both, nproc)
+        return _results(None, runs[outgroup], level, tests, setup)
+    
+    if outgroups == None:
+        ## creating hyde data file
+        dat = _read_data(infile, mapfile, outgroup, nindiv, ntaxa, nsite, remove_amb_site, nproc)
+        
+        tests = _run_tests(dat, runs[outgroup], level, nproc, both)
+        return _results(dat, runs[outgroup], level, tests, setup)
     
-    mapf = pd.read_csv(mapfile, delimiter='\t', header=None)
     
+    ## reading the alignment once and testing the triples of all the outgroups
+    ## in the same pass, so the site patterns of each taxon are shared
+    tagged = [ list(item) + [og] for og in runs for item in runs[og] ]
+    if pipeline:
+        dat = None
+        tests = sitepat.stream_tests(infile, mapfile, outgroups[0], nindiv, ntaxa, nsite, tagged,
+                                     level, remove_amb_site == True, both, nproc)
+    else:
+        dat = sitepat.read_sites(infile, mapfile, outgroups[0], nindiv, ntaxa, nsite,
+                                 remove_amb_site == True, shared = nproc > 1)
+        tests = _run_tests(dat, tagged, level, nproc, both)
+    
+    res = {}
+    start = 0
+    for og in runs:
+        stop = start + len(runs[og])
+        if both:
+            tests_og = [ t[start:stop] for t in tests ]
+        else:
+            tests_og = tests[start:stop]
+        setup_og = dict(setup)
+        setup_og["outgroup"] = og
+        res[og] = _results(dat, runs[og], level, tests_og, setup_og)
+        start = stop
+    return res
+
+
+## A function to make the results from the individual tests
+def _results(dat, comb, level, tests, setup):
+    """
+    A function that makes the tables of the tests of `comb` and runs the
+    global test, for both ambiguous site policies if `remove_amb_site` is
+    "both".
+    """
+    if setup["remove_amb_site"] == "both":
+        res = []
+        for t, amb_site in zip(tests, [False, True]):
+            result, hyb_sp, acc = _tabulate(dat, comb, level, t, setup["top_k"])
+            setup_amb = dict(setup)
+            setup_amb["remove_amb_site"] = amb_site
+            res.append(_finish(result, hyb_sp, setup_amb, acc))
+        return result_both(res[0], res[1])
     
-    ## get the name of all the species as list
-    species_all = list(mapf.iloc[:, 1])
+    result, hyb_sp, acc = _tabulate(dat, comb, level, tests, setup["top_k"])
     
+    return _finish(result, hyb_sp, setup, acc)
 
-    ## remove the outgroup from the list of species
-    species_all = [ sp for sp in species_all if sp!= outgroup ]
 
 
-    ## select all the unique species
-    unq_species =[]
+## approximate test on a subset of the sites
+def _approx(dat, comb, level, setup, approx, seed, ngroup = 20, nboot = 100, conf = 0.95, min_sites = 10):
+    """
+    A function that tests the triples in `comb` on a random subset of
+    `approx` sites of `dat` and returns a result_approx. The tests are done
+    on the counts of the site patterns of the subset, so the estimate is a
+    test at level `alpha` with the power of the sites in the subset. The
+    subset is split into `ngroup` groups of sites, which are resampled
+    `nboot` times for a `conf` band of the global p-value (with a finite
+    population correction, so the band shrinks to the p-value of all the
+    sites when they are all used). Sites are added to the subset, doubling
+    it, as long as `alpha` is inside the band, or some triple has fewer
+    than `min_sites` sites with the AABB, ABAB or ABBA pattern or no
+    estimate of gamma (the tests are then not reliable on the subset).
+    """
+    alpha = setup["alpha"]
+    nsite = dat.mat.shape[1]
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(nsite)
+    
+    m = max(1, min(nsite, int(approx)))
+    counts, nobs = dat.sample_counts(comb, level, perm[:m], ngroup)
+    
+    while True:
+        frac = m / nsite
+        total = counts.sum(axis=0)
+        ntotal = nobs.sum(axis=0)
+        tests = dat.test_counts(comb, level, total, ntotal)
+        result, hyb_sp, acc = _tabulate(dat, comb, level, tests, setup["top_k"])
+        estimate = _finish(result, hyb_sp, setup, acc)
+        if isinstance(estimate, str):
+            return estimate
+        
+        ## bootstrap of the groups of sites
+        shrink = math.sqrt(1 - frac)
+        boot = []
+        for b in range(nboot):
+            w = rng.multinomial(ngroup, [1/ngroup]*ngroup)
+            c = total + shrink*(np.tensordot(w, counts, 1) - total)
+            n = ntotal + shrink*(np.tensordot(w, nobs, 1) - ntotal)
+            result, hyb_sp, acc = _tabulate(dat, comb, level, dat.test_counts(comb, level, c, n), setup["top_k"])
+            boot.append(_finish(result, hyb_sp, setup, acc).p_value)
+        band = tuple(float(q) for q in np.quantile(boot, [(1 - conf)/2, (1 + conf)/2]))
+        band = (min(band[0], estimate.p_value), max(band[1], estimate.p_value))
+        
+        informative = dat.informative_sites(comb, level, total) >= min_sites
+        informative = informative and not result["Gamma"].isna().any()
+        stable = informative and (band[1] <= alpha or band[0] > alpha)
+        if stable or m == nsite:
+            return result_approx(estimate, band, stable, m)
+        
+        ## refining with more sites
+        m2 = min(nsite, 2*m)
+        dat.sample_counts(comb, level, perm[m:m2], ngroup, counts, nobs)
+        m = m2
+
+
 
-    for sp in species_all:
-        if sp not in unq_species:
-            unq_species.append(sp)
+## incremental re-analysis
+def update(previous, infile, mapfile, nindiv = None, ntaxa = None, nsite = None):
+    
+    """
+    Method for updating the result of `comb_species` or `comb_indiv` when
+    individuals or species are added to (or removed from) the data. Only the
+    triples involving a species whose individuals changed are tested again;
+    the tests of the other triples are taken from `previous` and the global
+    test is run on the merged table. The sequences of the individuals that
+    were already in the data are assumed to be unchanged. With group_by the
+    comb_tree of `previous` is updated, so only the groups with tests that
+    changed are combined again. A result_both (remove_amb_site = "both") is
+    updated for each of its two results.
+    
+    
+    Arguments
+    ---------
+ 
+        - previous        <result>: result of comb_species/comb_indiv/update.
+        - infile         <string> : name of the new DNA sequence data file.
+        - mapfile        <string> : name of the new taxon map file.
+        - nindiv            <int> : number of sampled individuals (default:
+                                    from the map file).
+        - ntaxa             <int> : number of sampled taxa/populations
+                                    (default: from the map file).
+        - nsites            <int> : number of sampled sites (default: from
+                                    the data file).
+        
+        
+    Example:
+    .. code:: py
+      import pyghdet as ghd
+      res = ghd.comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+      res = ghd.update(res, "data_new.txt", "map_new.txt")
+    """
+    
+    if isinstance(previous, result_both):
+        return result_both(update(previous.all_sites, infile, mapfile, nindiv, ntaxa, nsite),
+                           update(previous.unamb_sites, infile, mapfile, nindiv, ntaxa, nsite))
+    
+    setup = getattr(previous, "setup", None)
+    if setup == None or not isinstance(previous.tested, pd.DataFrame):
+        return "Error: The previous result does not keep the individual tests!"
     
+    outgroup = setup["outgroup"]
+    level = setup["level"]
+    sus_hyb = setup["sus_hyb"]
+    old_taxa = setup["taxa"]
+    taxa = _read_taxa(mapfile)
+    
+    if outgroup not in taxa:
+        return f"Error: The outgroup {outgroup} is not in the new map file!"
+    if nindiv == None:
+        nindiv = sum(len(taxa[sp]) for sp in taxa)
+    if ntaxa == None:
+        ntaxa = len(taxa)
+    if nsite == None:
+        nsite = _count_sites(infile)
+    
+    
+    ## select all the unique species without the outgroup
+    unq_species = [ sp for sp in taxa if sp!= outgroup ]
     
     if sus_hyb == None:
         comb = spcomb(unq_species, unq_species)
     else:
-        if set(sus_hyb).issubset(unq_species):
-            comb = spcomb(unq_species, sus_hyb)
-        else:
-           return f"Error:The provided suspected hybrid/s {sus_hyb} is/are not in the list of species in the data!"
-        
+        comb = spcomb(unq_species, sus_hyb)
+        if isinstance(comb, str):
+            return comb
     
-    p_val=[]
-    Z_score=[]
-    gamma = []
-    parent1=[]
-    hybrid=[]
-    parent2=[]
     
+    ## the species whose individuals changed, all of them if the outgroup changed
+    if taxa[outgroup] != old_taxa.get(outgroup):
+        changed = set(unq_species)
+    else:
+        changed = set(sp for sp in unq_species if taxa[sp] != old_taxa.get(sp))
+    
+    delta = [ item for item in comb if len(changed.intersection(item)) > 0 ]
     
     
+    ## the previous tests of the triples that did not change, matched on the
+    ## hybrid and the pair of parents: the order of the parents given by
+    ## spcomb changes from one python process to another
+    order = {}
     for item in comb:
-        p1 = item[0]
-        h = item[1]
-        p2 = item[2]
-        
-        res1 = dat.test_triple(p1, h, p2)
-        parent1.append(p1)
-        parent2.append(p2)
-        hybrid.append(h)
-        p_val.append(res1["Pvalue"])
-        Z_score.append(res1["Zscore"])
-        gamma.append(res1["Gamma"])
+        if len(changed.intersection(item)) == 0:
+            order[_triple_key(*item)] = len(order)
     
-
-    result = pd.DataFrame(list(zip(parent1, hybrid, parent2, gamma, Z_score, p_val)),
-                          columns=["Parent1", "Hybrid", "Parent2","Gamma", "Z_score", 
-                                   "P_value"])
+    old = previous.tested
+    if level == "indiv":
+        ind_sp = { ind: sp for sp in old_taxa for ind in old_taxa[sp] }
+        old_hyb = [ ind_sp[ind] for ind in old["Hybrid"].tolist() ]
+    else:
+        old_hyb = old["Hybrid"].tolist()
+    old_key = [ _triple_key(p1, h, p2) for p1, h, p2 in zip(old["Parent1"].tolist(), old_hyb, old["Parent2"].tolist()) ]
+    keep = [ key in order for key in old_key ]
     
-    sig_res = result[result["P_value"]< alpha]
+    kept = old[keep]
+    kept_hyb = [ h for h, k in zip(old_hyb, keep) if k ]
     
-    ## making the p-value ready for cct
-    pvs = []
     
-    for p in p_val:
-        if p==0:
-            pvs.append(1e-17)
-        else:
-            if p==1:
-                pvs.append(0.99)
-            else:
-                pvs.append(p)
+    ## testing the triples that changed
+    if len(delta) > 0:
+        dat = _read_data(infile, mapfile, outgroup, nindiv, ntaxa, nsite, setup["remove_amb_site"], setup["nproc"])
+        new, new_hyb, acc = _test_comb(dat, delta, level, setup["nproc"])
+    else:
+        new, new_hyb = kept.iloc[0:0], []
     
     
-    ## running the mcm test
-    global_pv = mcm(pvs)
+    ## merging the tests in the order of the triples
+    pos = { _triple_key(*item): i for i, item in enumerate(comb) }
+    rows = [ pos[_triple_key(p1, h, p2)] for p1, h, p2 in zip(kept["Parent1"].tolist(), kept_hyb, kept["Parent2"].tolist()) ]
+    rows += [ pos[_triple_key(p1, h, p2)] for p1, h, p2 in zip(new["Parent1"].tolist(), new_hyb, new["Parent2"].tolist()) ]
     
+    merged = pd.concat([kept, new], ignore_index = True)
+    merged_hyb = kept_hyb + new_hyb
+    idx = sorted(range(len(rows)), key = lambda i: rows[i])
     
-    ## returning the significant results if global null is rejected
+    result = merged.iloc[idx].reset_index(drop = True)
+    hyb_sp = [ merged_hyb[i] for i in idx ]
     
-    if global_pv <= alpha:
-        return result_det(global_pv, sig_res)
-    else:
-        return result_pv(global_pv)
+    setup = dict(setup)
+    setup["taxa"] = taxa
+    
+    
+    ## the comb_tree of the previous result, without the tests of the species
+    ## that changed or were removed and with the new tests: only the groups
+    ## they touch are combined again
+    tree = setup.pop("tree", None)
+    if tree != None:
+        tree = copy.deepcopy(tree)
+        for sp in list(tree.taxa):
+            if sp in changed or sp not in taxa:
+                tree.remove_taxon(sp)
+        _add_tests(tree, new, new_hyb, [ _ready_pv(p) for p in new["P_value"].tolist() ])
+    
+    return _finish(result, hyb_sp, setup, tree = tree)
@@ -0,0 +1,754 @@
+import numpy as np
+import math
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+import queue
+import re
+import threading
+
+try:
+    from pyghdet._sitecount import count_quads, UNIT
+except ImportError:
+    ## the extension is not built, the site patterns are counted with numpy
+    count_quads = None
+    UNIT = 144
+
+## the same coding of the bases as phyde: A, G, C, T = 0, 1, 2, 3, gap = 4,
+## ambiguous bases = 5 to 15 (N = 15)
+_BASE_TO_UINT8 = {
+    "A": 0, "G": 1, "C": 2, "T": 3, "U": 3, "-": 4,
+    "M": 5, "R": 6, "W": 7, "S": 8, "Y": 9, "K": 10,
+    "B": 11, "D": 12, "H": 13, "V": 14, "N": 15, "?": 15
+}
+
+_BASE_LOOKUP = {
+    5: [0, 2], 6: [0, 1], 7: [0, 3], 8: [1, 2], 9: [2, 3], 10: [1, 3],
+    11: [1, 2, 3], 12: [0, 1, 3], 13: [0, 2, 3], 14: [0, 1, 2],
+    15: [0, 1, 2, 3]
+}
+
+## lookup table from ascii characters to the codes of the bases
+_CODE = np.full(256, 15, dtype=np.uint8)
+for _b, _c in _BASE_TO_UINT8.items():
+    _CODE[ord(_b)] = _c
+    _CODE[ord(_b.lower())] = _c
+
+## weight of each of the four bases for the ambiguous codes
+_AMB_WEIGHT = np.zeros((16, 4))
+for _c, _l in _BASE_LOOKUP.items():
+    _AMB_WEIGHT[_c, _l] = 1.0 / len(_l)
+
+## the site patterns in the order used by phyde, the index of the pattern
+## of every (outgroup, parent1, hybrid, parent2) combination of the bases
+_PATTERNS = ["AAAA", "AAAB", "AABA", "AABB", "AABC", "ABAA", "ABAB", "ABAC",
+             "ABBA", "BAAA", "ABBC", "CABC", "BACA", "BCAA", "ABCD"]
+_CANONICAL = ["AAAA", "AAAB", "AABA", "AABB", "AABC", "ABAA", "ABAB", "ABAC",
+              "ABBA", "ABBB", "ABBC", "ABCA", "ABCB", "ABCC", "ABCD"]
+_PATTERN_INDEX = np.zeros(256, dtype=np.intp)
+for _i in range(256):
+    _q = [(_i >> 6) & 3, (_i >> 4) & 3, (_i >> 2) & 3, _i & 3]
+    _seen = []
+    for _x in _q:
+        if _x not in _seen:
+            _seen.append(_x)
+    _PATTERN_INDEX[_i] = _CANONICAL.index("".join("ABCD"[_seen.index(_x)] for _x in _q))
+
+## number of sites counted at once
+BLOCK = 1 << 14
+
+
+
+## A class to keep the alignment
+class site_data(object):
+    """
+    A class to hold the alignment as a matrix of the codes of the bases (one
+    row per individual) and the map of the individuals to the taxa. It has the
+    same `test_triple` and `test_individuals` methods as `phyde.HydeData`.
+    `amb` marks the sites where any individual has a gap or an ambiguous
+    base; the other sites are counted without resolving ambiguities.
+    The matrix can be kept in shared memory (see `read_sites`), then
+    `spec()` gives a small picklable description that other processes pass
+    to `site_data.attach` to use the same matrix without a copy.
+
+    Example:
+    .. code:: py
+      import pyghdet as ghd
+      dat = ghd.read_sites("data.txt", "map.txt", "out", 16, 4, 50000)
+      dat.test_triple("sp1", "sp2", "sp3")
+
+    """
+
+    def __init__(self, mat, taxon_map, outgroup, ignore_amb_sites = False, shm = None, amb = None):
+        self.mat = mat
+        self.taxonMap = taxon_map
+        self.outgroup = outgroup
+        self.ignore_amb_sites = ignore_amb_sites
+        self._shm = shm
+        if amb is None:
+            amb = (mat >= 4).any(0)
+        self.amb = amb
+
+    def spec(self):
+        """
+        Return the description of the shared memory used by `attach`.
+        """
+        return (self._shm.name, self.mat.shape, self.taxonMap, self.outgroup,
+                self.ignore_amb_sites)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Create a site_data on the matrix in the shared memory described by
+        `spec` without copying it.
+        """
+        name, shape, taxon_map, outgroup, ignore_amb_sites = spec
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            ## python < 3.13 registers the block with the resource tracker,
+            ## which would unlink it when this process exits. A tracker
+            ## inherited from the process that created the block (the
+            ## workers of `test_parallel`) keeps it for that process, any
+            ## other one is told to forget it.
+            inherited = resource_tracker._resource_tracker._fd != None
+            shm = shared_memory.SharedMemory(name=name)
+            if not inherited:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        mat, amb = _views(shm.buf, shape[0], shape[1])
+        return cls(mat, taxon_map, outgroup, ignore_amb_sites, shm, amb)
+
+    def close(self, unlink = False):
+        """
+        Release the shared memory, `unlink` it in the process that created it.
+        """
+        if self._shm != None:
+            self.mat = None
+            self.amb = None
+            self._shm.close()
+            if unlink:
+                self._shm.unlink()
+            self._shm = None
+
+    def resetOutgroup(self, newOut):
+        """
+        Reset the outgroup, as `phyde.HydeData.resetOutgroup`.
+        """
+        self.outgroup = newOut
+
+    def rows(self, taxon):
+        return tuple(i[0] for i in self.taxonMap[taxon])
+
+    def test_triple(self, p1, hyb, p2):
+        """
+        Test the hypothesis ((p1, hyb), p2) : gamma and (p1, (hyb, p2)) :
+        1-gamma, as `phyde.HydeData.test_triple`.
+        """
+        return self.test_many([(p1, hyb, p2)], "species")[0][hyb]
+
+    def test_individuals(self, p1, hyb, p2):
+        """
+        Test every individual of the putative hybrid, as
+        `phyde.HydeData.test_individuals`.
+        """
+        return self.test_many([(p1, hyb, p2)], "indiv")[0]
+
+    def test_many(self, comb, level, both = False):
+        """
+        Test all the triples in `comb` (each individual of the hybrid if
+        `level` is "indiv"), counting the site patterns one block of sites
+        at a time for all the triples. A triple can have a fourth item, the
+        outgroup to use instead of `outgroup`. Returns a list with one dictionary
+        per triple, as `test_individuals`. With `both` the tests on all the
+        sites and on the unambiguous sites only are done in the same pass and
+        the two lists are returned.
+        """
+        quads, keys = self._quads(comb, level)
+        counts, nobs = count_patterns(self.mat, quads, amb = self.amb)
+        return self._tests(counts, nobs, quads, keys, both)
+
+    def sample_counts(self, comb, level, sites, ngroup, counts = None, nobs = None):
+        """
+        Count the site patterns of the triples in `comb` over the `sites`
+        (column indices) only, split into `ngroup` groups (see
+        `group_counts`).
+        """
+        quads, keys = self._quads(comb, level)
+        return group_counts(self.mat, quads, sites, ngroup, self.amb, counts, nobs)
+
+    def test_counts(self, comb, level, counts, nobs, both = False):
+        """
+        Test the triples in `comb` from the counts of their site patterns
+        (as `count_patterns`) instead of counting them, as `test_many`.
+        """
+        quads, keys = self._quads(comb, level)
+        return self._tests(counts, nobs, quads, keys, both)
+
+    def informative_sites(self, comb, level, counts):
+        """
+        The smallest number of sites (over the combinations of individuals)
+        with the AABB, ABAB or ABBA pattern among the triples in `comb`, from
+        the counts of their site patterns (as `count_patterns`).
+        """
+        quads, keys = self._quads(comb, level)
+        view = 1 if self.ignore_amb_sites == True else 0
+        res = float("inf")
+        for q in range(len(quads)):
+            probs = np.bincount(_PATTERN_INDEX, weights=counts[q, view] / UNIT, minlength=15)
+            nquad = len(quads[q][0])*len(quads[q][1])*len(quads[q][2])*len(quads[q][3])
+            res = min(res, probs[3] / nquad, probs[6] / nquad, probs[8] / nquad)
+        return res
+
+    def _tests(self, counts, nobs, quads, keys, both):
+        if both:
+            views = [0, 1]
+        elif self.ignore_amb_sites:
+            views = [1]
+        else:
+            views = [0]
+        res = []
+        for view in views:
+            res_view = []
+            q = 0
+            for key in keys:
+                res_item = {}
+                for ind in key:
+                    res_item[ind] = hyde_test(counts[q, view], nobs[q, view], quads[q])
+                    q = q+1
+                res_view.append(res_item)
+            res.append(res_view)
+        if both:
+            return res
+        return res[0]
+
+    def _quads(self, comb, level):
+        quads = []
+        keys = []
+        for item in comb:
+            if len(item) > 3:
+                out = self.rows(item[3])
+            else:
+                out = self.rows(self.outgroup)
+            p1 = self.rows(item[0])
+            h = self.rows(item[1])
+            p2 = self.rows(item[2])
+            if level == "indiv":
+                key = [ i[1] for i in self.taxonMap[item[1]] ]
+                for r in h:
+                    quads.append((out, p1, (r,), p2))
+            else:
+                key = [ item[1] ]
+                quads.append((out, p1, h, p2))
+            keys.append(key)
+        return quads, keys
+
+
+
+## A function to allocate the matrix of the bases
+def alloc_sites(nindiv, nsite, shared = False):
+    """
+    A function that allocates the matrix of the bases (`nindiv` x `nsite`)
+    and the ambiguity mask of the sites, in one block of shared memory if
+    `shared` is True. Returns the matrix, the mask and the shared memory (or
+    None).
+    """
+    if shared:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, (nindiv+1)*nsite))
+        mat, amb = _views(shm.buf, nindiv, nsite)
+        mat[:] = 0
+        amb[:] = False
+        return mat, amb, shm
+    return np.zeros((nindiv, nsite), dtype=np.uint8), np.zeros(nsite, dtype=bool), None
+
+
+def _views(buf, nindiv, nsite):
+    ## the matrix is followed by the mask in the shared memory
+    mat = np.ndarray((nindiv, nsite), dtype=np.uint8, buffer=buf)
+    amb = np.ndarray((nsite,), dtype=bool, buffer=buf, offset=nindiv*nsite)
+    return mat, amb
+
+
+
+## A function to read the map file into a taxon map
+def read_taxon_map(mapfile):
+    """
+    A function that reads the taxon map file and returns, for each taxon,
+    the list of (row, individual) of its individuals as `phyde.HydeData`.
+    The individuals must be in the same order in the data and map files.
+    """
+    taxon_map = {}
+    with open(mapfile) as f:
+        for i, l in enumerate(f.read().splitlines()):
+            ind, taxon = l.split()[0], l.split()[1]
+            if taxon not in taxon_map:
+                taxon_map[taxon] = []
+            taxon_map[taxon].append((i, ind))
+    return taxon_map
+
+
+
+## A function to read the data file
+def read_sites(infile, mapfile, outgroup, nindiv, ntaxa, nsite, ignore_amb_sites = False, shared = False):
+    """
+    A function that reads the DNA sequence data file and the taxon map file
+    into a site_data. If `shared` is True the matrix is created in shared
+    memory, to be used by other processes with `site_data.attach`.
+
+    Example:
+    .. code:: py
+      import pyghdet as ghd
+      dat = ghd.read_sites("data.txt", "map.txt", "out", 16, 4, 50000)
+
+    """
+    mat, amb, shm = alloc_sites(nindiv, nsite, shared)
+    try:
+        row = 0
+        with open(infile) as f:
+            for line in f:
+                item = line.split()
+                if len(item) < 2:
+                    continue
+                if row == 0 and item[0].isdigit() and item[1].isdigit():
+                    continue
+                if len(item[1]) != nsite:
+                    raise ValueError(f"Number of sites specified ({nsite}) is not equal to the number of sites in the data file ({len(item[1])}).")
+                if row >= nindiv:
+                    raise ValueError(f"Number of individuals specified ({nindiv}) is not equal to the number of individuals in the data file.")
+                mat[row] = _CODE[np.frombuffer(item[1].encode(), dtype=np.uint8)]
+                amb |= mat[row] >= 4
+                row = row+1
+
+        taxon_map = read_taxon_map(mapfile)
+        if len(taxon_map) != ntaxa:
+            print(f"Warning: {len(taxon_map)} taxa in the map file, {ntaxa} expected.")
+    except BaseException:
+        ## nobody else can use the shared memory
+        if shm != None:
+            mat = amb = None
+            shm.close()
+            shm.unlink()
+        raise
+
+    return site_data(mat, taxon_map, outgroup, ignore_amb_sites, shm, amb)
+
+
+
+## A function to summarize the bases of a set of individuals
+def _summary(block, rows, has_amb = True):
+    """
+    Return, for each site of the block, the number of individuals in `rows`
+    with each unambiguous base and the summed weights of each base over the
+    individuals with an ambiguous base (gaps are left out), None if the
+    block has no ambiguous base.
+    """
+    x = block[list(rows)]
+    unamb = np.stack([ (x==b).sum(0) for b in range(4) ], 1).astype(float)
+    if not has_amb:
+        return unamb, None
+    amb = _AMB_WEIGHT[x].sum(0)
+    return unamb, amb
+
+
+def _total(x):
+    ## the number of individuals with an unambiguous (ambiguous) base
+    if x is None:
+        return None
+    return x.sum(1)
+
+
+def _pairs(a, b):
+    ## the combinations of the bases of two taxa (or combinations) at each
+    ## site
+    return (a[:, :, None]*b[:, None, :]).reshape(a.shape[0], -1)
+
+
+
+## A function to count the site patterns
+def count_patterns(mat, quads, start = 0, stop = None, counts = None, nobs = None, amb = None):
+    """
+    A function that counts the 256 combinations of the bases of the
+    (outgroup, parent1, hybrid, parent2) rows of each quadruple in `quads`
+    over the sites `start` to `stop` of `mat`, as phyde does: a combination
+    of individuals with a gap or with more than two ambiguous bases is left
+    out and an ambiguous base is spread evenly over the bases it stands for.
+    Returns the counts (n, 2, 256), in units of 1/UNIT of a combination of
+    individuals, and the number of observations (n, 2) for all the sites
+    ([:, 0]) and for the unambiguous sites only ([:, 1]), added to `counts`
+    and `nobs` if given. The counting is done by the compiled extension
+    (`pyghdet._sitecount`), where the counts are exact. Without it, the
+    sites are counted with numpy: the sites where `amb` (the ambiguity mask
+    of the sites) is False are counted without resolving ambiguities, the
+    distinct sites of each block are counted once, weighted by the number
+    of times they are found, and the individuals of a hybrid are counted
+    together.
+    """
+    if stop == None:
+        stop = mat.shape[1]
+    if counts is None:
+        counts = np.zeros((len(quads), 2, 256))
+        nobs = np.zeros((len(quads), 2))
+    if count_quads != None:
+        rows, bounds = _quad_rows(quads)
+        count_quads(np.ascontiguousarray(mat), rows, bounds, counts, nobs, start, stop)
+        return counts, nobs
+
+    for s in range(start, stop, BLOCK):
+        block = mat[:, s:min(s+BLOCK, stop)]
+        has_amb = amb is None or bool(amb[s:min(s+BLOCK, stop)].any())
+        block, weight = _unique_sites(block)
+        cache = {}
+        last = None
+        q = 0
+        while q < len(quads):
+            out, p1, hyb, p2 = quads[q]
+            ## the quadruples of the individuals of a triple share the outgroup
+            ## and the parents, their hybrids are counted together
+            e = q+1
+            while e < len(quads) and quads[e][0] == out and quads[e][1] == p1 and quads[e][3] == p2:
+                e = e+1
+            for rows in [out, p1, p2] + [ quads[i][2] for i in range(q, e) ]:
+                if rows not in cache:
+                    sm = _summary(block, rows, has_amb)
+                    cache[rows] = (sm, (_total(sm[0]), _total(sm[1])))
+            if last != (out, p1, p2):
+                parents = _combine(_combine(cache[out], cache[p1]), cache[p2])
+                last = (out, p1, p2)
+            hybs = [ cache[quads[i][2]] for i in range(q, e) ]
+            _add_counts(parents, hybs, weight, counts[q:e], nobs[q:e])
+            q = e
+    return counts, nobs
+
+
+def _quad_rows(quads):
+    ## the rows of the taxa of the quadruples, one after the other, and the
+    ## bounds of the rows of the four taxa of each quadruple
+    rows = []
+    first = {}
+    bounds = np.zeros((len(quads), 8), dtype=np.int64)
+    for q, quad in enumerate(quads):
+        for t, r in enumerate(quad):
+            if r not in first:
+                first[r] = len(rows)
+                rows.extend(r)
+            bounds[q, 2*t] = first[r]
+            bounds[q, 2*t+1] = first[r] + len(r)
+    return np.array(rows, dtype=np.int64), bounds
+
+
+def group_counts(mat, quads, sites, ngroup, amb = None, counts = None, nobs = None):
+    """
+    A function that counts the site patterns of `quads` (see
+    `count_patterns`) over the `sites` (column indices) of `mat`, split into
+    `ngroup` groups: the i-th site of `sites` goes to the group i % `ngroup`.
+    Returns the counts (ngroup, n, 2, 256) and the number of observations
+    (ngroup, n, 2), added to `counts` and `nobs` if given.
+    """
+    if counts is None:
+        counts = np.zeros((ngroup, len(quads), 2, 256))
+        nobs = np.zeros((ngroup, len(quads), 2))
+    for g in range(ngroup):
+        sub = np.sort(sites[g::ngroup])
+        if len(sub) == 0:
+            continue
+        count_patterns(mat[:, sub], quads, counts = counts[g], nobs = nobs[g],
+                       amb = None if amb is None else amb[sub])
+    return counts, nobs
+
+
+def _combine(x, y):
+    ## the combinations of the bases of two sets of rows (or of combinations)
+    ## at each site with 0, 1 and 2 ambiguous bases, and their numbers
+    cx, nx = _levels(x)
+    cy, ny = _levels(y)
+    c = []
+    n = []
+    for k in range(min(3, len(cx) + len(cy) - 1)):
+        c.append(sum(_pairs(cx[i], cy[k-i]) for i in range(k+1) if i < len(cx) and k-i < len(cy)))
+        n.append(sum(nx[i]*ny[k-i] for i in range(k+1) if i < len(cx) and k-i < len(cy)))
+    return c, n
+
+
+def _levels(x):
+    ## the bases of a summary (see `_summary`) or of a combination, by the
+    ## number of ambiguous bases
+    if isinstance(x[0], list):
+        return x
+    (u, a), (nu, na) = x
+    if a is None:
+        return [u], [nu]
+    return [u, a], [nu, na]
+
+
+def _unique_sites(block):
+    ## the distinct sites (columns) of the block and the number of times each
+    ## one is found
+    rows = np.ascontiguousarray(block.T)
+    key = rows.view(np.dtype((np.void, rows.shape[1]))).ravel()
+    _, first, weight = np.unique(key, return_index=True, return_counts=True)
+    return block[:, first], weight.astype(float)
+
+
+def _add_counts(parents, hybs, weight, counts, nobs):
+    ## the combinations of the outgroup and the parents with the bases of
+    ## each hybrid, with at most two ambiguous bases in all, over the sites
+    ## found `weight` times; the hybrids are counted with one product of
+    ## matrices
+    (c, n) = parents
+    nsite = c[0].shape[0]
+    hu = (np.stack([ h[0][0] for h in hybs ], 1)*weight[:, None, None]).reshape(nsite, -1)
+    nhu = np.stack([ h[1][0] for h in hybs ], 1)*weight[:, None]
+    u0 = _order(hu.T @ c[0], len(hybs))*UNIT
+    n0 = nhu.T @ n[0]
+    counts[:, 1] += u0
+    nobs[:, 1] += n0
+    if len(c) == 1:
+        counts[:, 0] += u0
+        nobs[:, 0] += n0
+        return
+
+    ha = (np.stack([ h[0][1] for h in hybs ], 1)*weight[:, None, None]).reshape(nsite, -1)
+    nha = np.stack([ h[1][1] for h in hybs ], 1)*weight[:, None]
+    c01 = c[0] + c[1]
+    n01 = n[0] + n[1]
+    counts[:, 0] += _order(hu.T @ (c01 + c[2]) + ha.T @ c01, len(hybs))*UNIT
+    nobs[:, 0] += nhu.T @ (n01 + n[2]) + nha.T @ n01
+
+
+def _order(x, nhyb):
+    ## (hybrid, hybrid base, outgroup, parent1, parent2) to the index of the
+    ## site patterns of each hybrid
+    return x.reshape(nhyb, 4, 16, 4).transpose(0, 2, 1, 3).reshape(nhyb, 256)
+
+
+
+## The hyde test from the site pattern counts
+def hyde_test(counts, nobs, quad):
+    """
+    A function that computes the Z-score, the p-value and the estimate of
+    gamma from the counts of the site patterns (see `count_patterns`), as
+    `phyde.HydeData.test_triple`.
+    """
+    probs = np.bincount(_PATTERN_INDEX, weights=counts / UNIT, minlength=15)
+    nquad = len(quad[0])*len(quad[1])*len(quad[2])*len(quad[3])
+
+    with np.errstate(all='ignore'):
+        nobs = np.float64(nobs)
+        avobs = nobs / nquad
+        z_val = _calc_gh(probs, nobs, avobs)
+        c = (avobs*(probs[8] - probs[6])) / (avobs*(probs[3] - probs[6]))
+        gamma = c / (1 + c)
+
+    res = {"Zscore": float(z_val), "Pvalue": _calc_p_value(float(z_val)), "Gamma": float(gamma)}
+    for i in range(15):
+        res[_PATTERNS[i]] = float(probs[i])
+    return res
+
+
+def _calc_gh(probs, nobs, avobs):
+    temp = -99999.9
+    if abs((1.0 / nobs) * probs.sum() - 1.0) > 0.05:
+        return temp
+    p9 = (probs[8] + 0.05) / nobs
+    p7 = (probs[6] + 0.05) / nobs
+    p4 = (probs[3] + 0.05) / nobs
+    obs_invp1 = avobs * (p9 - p7)
+    obs_invp2 = avobs * (p4 - p7)
+    if obs_invp1 == 0:
+        obs_invp1 += 1.0
+        obs_invp2 += 1.0
+    obs_var_invp1 = avobs * p9 * (1 - p9) + avobs * p7 * (1 - p7) + 2 * avobs * p9 * p7
+    obs_var_invp2 = avobs * p4 * (1 - p4) + avobs * p7 * (1 - p7) + 2 * avobs * p4 * p7
+    obs_cov_invp1_invp2 = -1 * avobs * p9 * p4 + avobs * p9 * p7 + avobs * p7 * p4 + avobs * p7 * (1 - p7)
+    ratio = obs_invp2 / obs_invp1
+    gh_ts = ((obs_invp1) * (ratio) / np.sqrt(obs_var_invp1 * (ratio ** 2.0) - 2.0
+             * obs_cov_invp1_invp2 * ratio + obs_var_invp2))
+    if p7 > p9 and p7 < p4:
+        return temp
+    elif gh_ts > -99999.9 and gh_ts < 99999.9:
+        return gh_ts
+    else:
+        return temp
+
+
+def _calc_p_value(my_z):
+    a1 =  0.254829592
+    a2 = -0.284496736
+    a3 =  1.421413741
+    a4 = -1.453152027
+    a5 =  1.061405429
+    p  =  0.3275911
+    sign = 1
+    if my_z < 0:
+        sign = -1
+    z = abs(my_z) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + p * z)
+    y = 1.0 - (((((a5 * t + a4) * t) + a3) * t + a2) * t + a1) * t * math.exp(-z * z)
+    return 1.0 - (0.5 * (1.0 + sign * y))
+
+
+
+## running the tests in several processes on the shared alignment
+_DATA = None
+
+def _attach(spec):
+    global _DATA
+    _DATA = site_data.attach(spec)
+
+
+def _test_chunk(args):
+    comb, level, both = args
+    return _DATA.test_many(comb, level, both)
+
+
+def test_parallel(dat, comb, level, nproc, both = False):
+    """
+    A function that tests the triples in `comb` in `nproc` processes. `dat`
+    must be in shared memory (`read_sites(..., shared = True)`); the worker
+    processes attach to it instead of receiving a copy. Returns the results
+    in the order of `comb`, as `site_data.test_many(comb, level, both)`.
+    """
+    nchunk = min(len(comb), 4*nproc)
+    if nchunk == 0:
+        return [[], []] if both else []
+    size = -(-len(comb) // nchunk)
+    chunks = [ (comb[i:i+size], level, both) for i in range(0, len(comb), size) ]
+    with mp.Pool(nproc, initializer=_attach, initargs=(dat.spec(),)) as pool:
+        res = pool.map(_test_chunk, chunks)
+    if both:
+        return [ [ r for chunk in res for r in chunk[v] ] for v in range(2) ]
+    return [ r for chunk in res for r in chunk ]
+
+
+
+## pipelined reading and counting
+def index_sites(infile, nindiv, nsite):
+    """
+    A function that finds where the sequence of each individual starts in
+    the DNA sequence data file, skipping over the sequences, so that the
+    sites can be read one block of columns at a time. Returns the offsets
+    of the sequences, in the order of the file.
+    """
+    offsets = []
+    row = 0
+    with open(infile, "rb") as f:
+        while True:
+            pos = f.tell()
+            head = f.read(4096)
+            if not head:
+                break
+            m = re.match(rb"\s*(\S+)[ \t]+(\S)", head)
+            end = head.find(b"\n")
+            if m == None or (end >= 0 and m.start(2) > end):
+                ## a blank line or a line with one item
+                if end < 0:
+                    break
+                f.seek(pos + end + 1)
+                continue
+            line = head[:end].split() if end >= 0 else []
+            if row == 0 and len(line) == 2 and line[0].isdigit() and line[1].isdigit():
+                f.seek(pos + end + 1)
+                continue
+            if row >= nindiv:
+                raise ValueError(f"Number of individuals specified ({nindiv}) is not equal to the number of individuals in the data file.")
+            offsets.append(pos + m.start(2))
+            f.seek(pos + m.start(2) + nsite)
+            rest = f.readline()
+            if rest.strip() != b"":
+                raise ValueError(f"Number of sites specified ({nsite}) is not equal to the number of sites in the data file.")
+            row = row+1
+    return offsets
+
+
+def _read_chunks(infile, offsets, nsite, queues, error):
+    ## the reader thread: sends each block of columns (and its ambiguity
+    ## mask) to every counting thread, then None
+    try:
+        with open(infile, "rb") as f:
+            for s in range(0, nsite, BLOCK):
+                e = min(s+BLOCK, nsite)
+                chunk = np.empty((len(offsets), e-s), dtype=np.uint8)
+                for r in range(len(offsets)):
+                    f.seek(offsets[r] + s)
+                    raw = f.read(e-s)
+                    if len(raw) != e-s or re.search(rb"\s", raw):
+                        raise ValueError(f"Number of sites specified ({nsite}) is not equal to the number of sites in the data file.")
+                    chunk[r] = _CODE[np.frombuffer(raw, dtype=np.uint8)]
+                amb = (chunk >= 4).any(0)
+                for q in queues:
+                    if error:
+                        break
+                    q.put((chunk, amb))
+                if error:
+                    break
+    except Exception as err:
+        error.append(err)
+    finally:
+        for q in queues:
+            q.put(None)
+
+
+def _count_chunks(q, quads, counts, nobs, error):
+    ## a counting thread: adds the counts of its quadruples over each block
+    ## of columns, in the order of the sites
+    while True:
+        item = q.get()
+        if item == None:
+            return
+        if error:
+            continue
+        try:
+            count_patterns(item[0], quads, counts = counts, nobs = nobs, amb = item[1])
+        except Exception as err:
+            error.append(err)
+
+
+def stream_tests(infile, mapfile, outgroup, nindiv, ntaxa, nsite, comb, level, ignore_amb_sites = False, both = False, nthread = 1, depth = 2):
+    """
+    A function that tests the triples in `comb` while the DNA sequence data
+    file is read: a reader thread reads it one block of columns at a time
+    and `nthread` counting threads (each with a share of the triples) add
+    the counts of the site patterns of each block as it comes. The queues
+    between them hold at most `depth` blocks, so only a few blocks are in
+    memory at any time. The GIL is released while a block is counted (with
+    the compiled extension, see `count_patterns`), so the threads count
+    at the same time as the file is read. The results are those of
+    `site_data.test_many`, and of `phyde` unless the data has the
+    three-base codes B, D, H or V (then to rounding). Returns the results
+    as `site_data.test_many(comb, level, both)`.
+
+    Example:
+    .. code:: py
+      import pyghdet as ghd
+      ghd.sitepat.stream_tests("data.txt", "map.txt", "out", 16, 4, 50000, [["sp1", "sp2", "sp3"]], "species")
+
+    """
+    taxon_map = read_taxon_map(mapfile)
+    if len(taxon_map) != ntaxa:
+        print(f"Warning: {len(taxon_map)} taxa in the map file, {ntaxa} expected.")
+    offsets = index_sites(infile, nindiv, nsite)
+    if len(offsets) != nindiv:
+        raise ValueError(f"Number of individuals specified ({nindiv}) is not equal to the number of individuals in the data file.")
+
+    ## a site_data without sites, for the rows of the taxa
+    dat = site_data(np.zeros((nindiv, 0), dtype=np.uint8), taxon_map, outgroup, ignore_amb_sites)
+    quads, keys = dat._quads(comb, level)
+    counts = np.zeros((len(quads), 2, 256))
+    nobs = np.zeros((len(quads), 2))
+
+    nthread = max(1, min(nthread, len(quads)))
+    size = -(-len(quads) // nthread) if len(quads) > 0 else 1
+    error = []
+    queues = []
+    threads = []
+    for i in range(0, max(len(quads), 1), size):
+        q = queue.Queue(maxsize = depth)
+        queues.append(q)
+        threads.append(threading.Thread(target = _count_chunks, args = (q, quads[i:i+size], counts[i:i+size], nobs[i:i+size], error)))
+    threads.append(threading.Thread(target = _read_chunks, args = (infile, offsets, nsite, queues, error)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if error:
+        raise error[0]
+
+    return dat._tests(counts, nobs, quads, keys, both)
@@ -14,13 +14,21 @@ For more details on script arguments, type: run_hyde.py -h
  
     - infile         <string> : name of the DNA sequence data file.
     - mapfile        <string> : name of the taxon map file.
-    - outgroup       <string> : name of the outgroup.
+    - outgroup       <string> : name of the outgroup (repeat -o for several
+                                outgroups, analyzed from a single parse).
     - nindiv            <int> : number of sampled individuals.
     - ntaxa             <int> : number of sampled taxa/populations.
     - nsites            <int> : number of sampled sites.
     - sus_hyb         <string>: list of suspected hybrid species.
     - alpha            <float>: intended level of significance.
     - ignore_amb_sites <flag> : ignore missing/ambiguous sites.
+    - both_amb_sites   <flag> : test with and without the missing/ambiguous
+                                sites in one pass.
+    - nproc             <int> : number of processes.
+    - approx            <int> : test on a random subset of this many sites.
+    - seed              <int> : seed of the random subset of sites.
+    - pipeline         <flag> : test while the alignment is read.
+    - top_k             <int> : keep only the top_k best tests, ranked.
         
         
 Output
@@ -42,8 +50,8 @@ if __name__ == "__main__":
                           metavar='\b', help="name of the data input file")
     required.add_argument('-m', '--map', action="store", type=str, required=True,
                           metavar='\b', help="map of individuals to taxa")
-    required.add_argument('-o', '--outgroup', action="store", type=str, required=True,
-                          metavar='\b', help="name of the outgroup (only one accepted)")
+    required.add_argument('-o', '--outgroup', action="append", type=str, required=True,
+                          metavar='\b', help="name of the outgroup (repeat for several outgroups)")
     required.add_argument('-n', '--num_ind', action="store", type=int, required=True,
                           metavar='\b', help="number of individuals in data matrix")
     required.add_argument('-t', '--num_taxa', action="store", type=int, required=True,
@@ -60,11 +68,24 @@ if __name__ == "__main__":
                             help="Chosen level of significance")
     additional.add_argument('--ignore_amb_sites', action="store_true",
                             help="ignore missing/ambiguous sites")
+    additional.add_argument('--both_amb_sites', action="store_true",
+                            help="test with and without the missing/ambiguous sites in one pass")
+    additional.add_argument('-p', '--nproc', action="store", type=int,
+                            help="number of processes (alignment in shared memory)")
+    additional.add_argument('--approx', action="store", type=int,
+                            help="approximate test on a random subset of this many sites")
+    additional.add_argument('--seed', action="store", type=int, default=0,
+                            help="seed of the random subset of sites")
+    additional.add_argument('--pipeline', action="store_true",
+                            help="test while the alignment is read, one block of sites at a time")
+    additional.add_argument('-k', '--top_k', action="store", type=int,
+                            help="keep only the top_k tests with the smallest p-values, ranked")
 
     args             = parser.parse_args()
     infile           = args.infile
     mapfile          = args.map
-    outgroup         = args.outgroup
+    outgroups        = args.outgroup
+    outgroup         = outgroups[0]
     nind             = args.num_ind
     ntaxa            = args.num_taxa
     nsites           = args.num_sites
@@ -72,6 +93,12 @@ if __name__ == "__main__":
     sus_hyb          = args.sus_hyb
     alpha            = args.alpha
     ignore_amb_sites = args.ignore_amb_sites
+    nproc            = args.nproc
+    both_amb_sites   = args.both_amb_sites
+    approx           = args.approx
+    seed             = args.seed
+    pipeline         = args.pipeline
+    top_k            = args.top_k
 
     
     print(quiet)
@@ -82,5 +109,20 @@ if __name__ == "__main__":
         sus_hyb = list(sus_hyb.split(","))
     if alpha == None:
         alpha = 0.05
+    if nproc == None:
+        nproc = 1
+    if len(outgroups) == 1:
+        outgroups = None
+    if both_amb_sites:
+        ignore_amb_sites = "both"
     
-    pyghdet.comb_species(infile, mapfile, outgroup, nind, ntaxa, nsites, sus_hyb, alpha, ignore_amb_sites)
+    res = pyghdet.comb_species(infile, mapfile, outgroup, nind, ntaxa, nsites, sus_hyb, alpha, ignore_amb_sites, nproc = nproc, outgroups = outgroups, approx = approx, seed = seed, pipeline = pipeline, top_k = top_k)
+    
+    ## printing the ranked tests, the approximate result or the result of
+    ## each outgroup
+    if top_k != None or approx != None or outgroups != None:
+        if isinstance(res, dict):
+            for og in res:
+                print(f"\noutgroup: {og}{res[og]}")
+        else:
+            print(res)
@@ -86,6 +86,7 @@ else:
         author="Rejuan Haque & Laura Kubatko",
         author_email="haque.62@osu.edu",
         packages=find_packages(),
+        ext_modules=cythonize([Extension("pyghdet._sitecount", ["pyghdet/_sitecount.pyx"])]),
         scripts=[
             'scripts/hdet_indiv.py',
             'scripts/hdet_species.py'
@@ -1,5 +1,17 @@
 """ A python file to test the pytorn package."""
 from pyghdet import *
+from pyghdet import pytorn
+from pyghdet import sitepat
+import numpy as np
+import os
+import pickle
+import subprocess
+import sys
+import multiprocessing as mp
+import pytest
+import phyde
+import re
+import time
 
 unq_species = ['a', 'b', 'c', 'd']
 sus_species = ['e']
@@ -72,6 +84,13 @@ def test_species():
     res3 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, alpha = 0.10, remove_amb_site = True)
     assert 0<= res3.p_value <= 1
 
+    ## the ambiguous sites are left out, as phyde's ignore_amb_sites (they
+    ## were counted before, only phyde's output was quiet)
+    hyde = pytorn.hd.HydeData("data.txt", "map.txt", "out", 16, 4, 50000, quiet = True, ignore_amb_sites = True)
+    p1, hyb, p2 = res3.tested.loc[0, ["Parent1", "Hybrid", "Parent2"]]
+    assert res3.tested.loc[0, "Z_score"] == hyde.test_triple(p1, hyb, p2)["Zscore"]
+    assert not np.allclose(res3.tested["Z_score"], res.tested["Z_score"])
+
 
 def test_indiv2():
     res = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000,sus_hyb=['sp1'], alpha = 0.05)
@@ -106,3 +125,419 @@ def test_indiv3():
 def test_species3():
     res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000,sus_hyb=['sp8'], alpha = 0.05)
     assert res == "Error:The provided suspected hybrid/s ['sp8'] is/are not in the list of species in the data!"
+
+
+def test_tree():
+    tr = comb_tree("hybrid")
+    tr.add(['a', 'b', 'c'], 0.01)
+    tr.add(['a', 'c', 'b'], 0.40)
+    tr.add(['b', 'c', 'a'], 0.30)
+    assert 0 <= tr.p_value() <= 1
+    assert tr.group_p_values()['b'] == cct([0.01])
+    assert tr.group_p_values()['c'] == cct([0.40, 0.30])
+    assert tr.p_value() == cct([cct([0.01]), cct([0.40, 0.30])])
+
+    tr.remove_taxon('a')
+    assert tr.group_p_values() == {}
+    assert tr.p_value() == None
+
+
+def test_tree2():
+    tr = comb_tree({'a': 'x', 'b': 'x', 'c': 'y'}, "mcm")
+    tr.add(['a', 'b', 'c'], 0.01)
+    tr.add(['b', 'a', 'c'], 0.02)
+    tr.add(['a', 'c', 'b'], 0)
+    assert list(tr.group_p_values()) == ['x', 'y']
+    assert tr.p_value() == mcm([cct([0.01, 0.02]), cct([1e-17])])
+
+
+def test_species_tree():
+    res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, group_by = "hybrid")
+    assert 0<= res.p_value <= 1
+
+    res2 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, group_by = "parents", tree_method = "mcm")
+    assert 0<= res2.p_value <= 1
+
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, group_by = {'sp1': 'c1', 'sp2': 'c1', 'sp3': 'c2'})
+    assert 0<= res3.p_value <= 1
+
+    res4 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, group_by = "clade")
+    assert res4 == "Error: group_by must be 'hybrid', 'parents' or a dictionary of clades, not clade!"
+
+
+def _subset(tmp_path, drop, datafile = "data.txt", mapfile = "map.txt"):
+    ## write the data and map files without the individuals in `drop`
+    with open(mapfile) as f:
+        maps = [ l for l in f.read().splitlines() if l.split()[0] not in drop ]
+    with open(datafile) as f:
+        lines = f.read().splitlines()
+    seqs = [ l for l in lines[1:] if l.split()[0] not in drop ]
+    infile = str(tmp_path / "data_sub.txt")
+    mapfile = str(tmp_path / "map_sub.txt")
+    with open(infile, "w") as f:
+        f.write(f"{len(seqs)} {len(seqs[0].split()[1])}\n" + "\n".join(seqs) + "\n")
+    with open(mapfile, "w") as f:
+        f.write("\n".join(maps) + "\n")
+    return infile, mapfile, len(seqs)
+
+
+def _random_map(tmp_path, nspecies):
+    ## write a map file with two individuals for the outgroup and each of
+    ## `nspecies` species
+    mapfile = str(tmp_path / "map_random.txt")
+    with open(mapfile, "w") as f:
+        f.write("".join(f"{t}_{i}\t{t}\n" for t in ["out"] + [ f"sp{j}" for j in range(nspecies) ] for i in range(2)))
+    return mapfile
+
+
+def _random_data(tmp_path, nsite, mapfile = "map.txt", seed = 0):
+    ## write an alignment of random bases (1% N) for the individuals of the
+    ## map file: no hybrid signal and almost no repeated sites
+    rng = np.random.default_rng(seed)
+    names = [ l.split()[0] for l in open(mapfile) ]
+    bases = np.array(list("ACGTN"))[rng.choice(5, (len(names), nsite), p = [0.2475]*4 + [0.01])]
+    infile = str(tmp_path / "data_random.txt")
+    with open(infile, "w") as f:
+        f.write(f"{len(names)} {nsite}\n")
+        for n, b in zip(names, bases):
+            f.write(n + "\t" + "".join(b) + "\n")
+    return infile
+
+
+def test_update_species(tmp_path):
+    drop = [ l.split()[0] for l in open("map.txt") if l.split()[1] == "sp3" ][:2]
+    infile, mapfile, nind = _subset(tmp_path, drop)
+    res = comb_species(infile, mapfile, "out", nind, 4, 50000)
+    res2 = update(res, "data.txt", "map.txt")
+    res3 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+    assert res2.p_value == res3.p_value
+    assert res2.tested.equals(res3.tested)
+
+
+def test_update_indiv(tmp_path):
+    drop = [ l.split()[0] for l in open("map.txt") if l.split()[1] == "sp2" ][:1]
+    infile, mapfile, nind = _subset(tmp_path, drop)
+    res = comb_indiv(infile, mapfile, "out", nind, 4, 50000, sus_hyb = ['sp1', 'sp2'])
+    res2 = update(res, "data.txt", "map.txt", 16, 4, 50000)
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, sus_hyb = ['sp1', 'sp2'])
+    assert res2.p_value == res3.p_value
+    assert res2.tested.equals(res3.tested)
+    assert update(pytorn.result_pv(0.5), "data.txt", "map.txt") == "Error: The previous result does not keep the individual tests!"
+
+
+def test_update_hashseed(tmp_path):
+    ## the result is updated in other python processes, where spcomb gives
+    ## the parents of the triples in other orders
+    mapfile = _random_map(tmp_path, 5)
+    infile = _random_data(tmp_path, 20000, mapfile)
+    subfile, submap, nind = _subset(tmp_path, ["sp4_1"], infile, mapfile)
+    env = dict(os.environ, PYTHONPATH = os.path.dirname(os.path.dirname(sitepat.__file__)))
+    first = str(tmp_path / "res.pkl")
+    code = "import sys, pickle; from pyghdet import *; pickle.dump(comb_species(sys.argv[1], sys.argv[2], 'out', int(sys.argv[3]), 6, 20000), open(sys.argv[4], 'wb'))"
+    subprocess.run([sys.executable, "-c", code, subfile, submap, str(nind), first], env = dict(env, PYTHONHASHSEED = "1"), check = True, capture_output = True)
+    res = pickle.load(open(first, "rb"))
+    res3 = comb_species(infile, mapfile, "out", 12, 6, 20000)
+
+    code = "import sys, pickle; from pyghdet import *; pickle.dump(update(pickle.load(open(sys.argv[1], 'rb')), sys.argv[2], sys.argv[3]), open(sys.argv[4], 'wb'))"
+    for seed in ["2", "3"]:
+        second = str(tmp_path / f"res{seed}.pkl")
+        subprocess.run([sys.executable, "-c", code, first, infile, mapfile, second], env = dict(env, PYTHONHASHSEED = seed), check = True, capture_output = True)
+        res2 = pickle.load(open(second, "rb"))
+        keys = lambda t: [ pytorn._triple_key(*r) for r in t[["Parent1", "Hybrid", "Parent2"]].values.tolist() ]
+        assert len(res2.tested) == len(res3.tested)
+        assert set(keys(res2.tested)) == set(keys(res3.tested))
+        ## the tests without sp4 are those of the first process
+        old = { k: r for k, r in zip(keys(res.tested), res.tested.values.tolist()) }
+        for k, r in zip(keys(res2.tested), res2.tested.values.tolist()):
+            if "sp4" not in k[1] and k[0] != "sp4":
+                assert r == old[k]
+
+
+def test_update_tree(tmp_path, monkeypatch):
+    ## only the groups of parents with sp4 are combined again
+    mapfile = _random_map(tmp_path, 5)
+    infile = _random_data(tmp_path, 20000, mapfile)
+    subfile, submap, nind = _subset(tmp_path, ["sp4_1"], infile, mapfile)
+    res = comb_species(subfile, submap, "out", nind, 6, 20000, sus_hyb = ['sp0', 'sp1'], group_by = "parents")
+    res3 = comb_species(infile, mapfile, "out", 12, 6, 20000, sus_hyb = ['sp0', 'sp1'], group_by = "parents")
+
+    calls = []
+    def count_cct(pvals, weights = None):
+        calls.append(len(pvals))
+        return cct(pvals, weights)
+    monkeypatch.setattr(pytorn, "cct", count_cct)
+    res2 = update(res, infile, mapfile)
+    groups = res2.setup["tree"].groups
+    touched = [ key for key in groups if "sp4" in key ]
+    assert 0 < len(touched) < len(groups)
+    ## the touched groups, then the global test
+    assert len(calls) == len(touched) + 1
+    assert res2.p_value == pytest.approx(res3.p_value)
+    assert res2.tested.equals(res3.tested)
+    assert res.setup["tree"].groups != groups
+
+
+def test_sites():
+    dat = read_sites("data.txt", "map.txt", "out", 16, 4, 50000)
+    res = dat.test_triple('sp1', 'sp2', 'sp3')
+    res2 = dat.test_individuals('sp1', 'sp2', 'sp3')
+    assert 0 <= res["Pvalue"] <= 1
+    assert len(res2) == 4
+    assert sum(res[k] for k in res if k not in ("Zscore", "Pvalue", "Gamma")) > 0
+
+
+@pytest.mark.skipif(sitepat.count_quads == None, reason = "the extension is not built")
+def test_sites_phyde(tmp_path, monkeypatch):
+    ## without the three-base codes (B, D, H, V) the counts are those of phyde
+    ## to the bit
+    infile = str(tmp_path / "data_nobdhv.txt")
+    with open("data.txt") as f, open(infile, "w") as g:
+        g.write(re.sub("[BDHV]", "N", f.read()))
+    comb = spcomb(['sp1', 'sp2', 'sp3'], ['sp1', 'sp2', 'sp3'])
+    for amb in [False, True]:
+        hd = phyde.HydeData(infile, "map.txt", "out", 16, 4, 50000, quiet = True, ignore_amb_sites = amb)
+        dat = read_sites(infile, "map.txt", "out", 16, 4, 50000, amb)
+        for t, res in zip(comb, dat.test_many(comb, "indiv")):
+            assert res == hd.test_individuals(*t)
+        for t, res in zip(comb, dat.test_many(comb, "species")):
+            assert res[t[1]] == hd.test_triple(*t)
+
+    ## the numpy counting, without the extension, to rounding
+    res = dat.test_many(comb, "species")
+    monkeypatch.setattr(sitepat, "count_quads", None)
+    res2 = dat.test_many(comb, "species")
+    for t, r, r2 in zip(comb, res, res2):
+        for k in r[t[1]]:
+            assert r2[t[1]][k] == pytest.approx(r[t[1]][k], rel = 1e-9)
+
+
+def test_species_nproc():
+    res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+    res2 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, nproc = 2)
+    assert res2.p_value == pytest.approx(res.p_value)
+    assert np.allclose(res2.tested["Z_score"], res.tested["Z_score"])
+
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, remove_amb_site = True)
+    res4 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, remove_amb_site = True, nproc = 2)
+    assert res4.p_value == pytest.approx(res3.p_value)
+    assert np.allclose(res4.tested["Z_score"], res3.tested["Z_score"])
+
+
+def _rss_anon():
+    ## private (not shared) resident memory of this process
+    with open("/proc/self/status") as f:
+        for l in f:
+            if l.startswith("RssAnon:"):
+                return int(l.split()[1])*1024
+
+
+def _touch(spec):
+    before = _rss_anon()
+    dat = sitepat.site_data.attach(spec)
+    total = int(dat.mat.sum(dtype=np.uint64))
+    after = _rss_anon()
+    dat.close()
+    return after - before, total
+
+
+def test_shared_rss():
+    nind, nsite = 8, 4000000
+    mat, amb, shm = sitepat.alloc_sites(nind, nsite, shared = True)
+    mat[:] = 3
+    dat = sitepat.site_data(mat, {'out': [(0, 'o')]}, 'out', shm = shm, amb = amb)
+    with mp.Pool(4) as pool:
+        res = pool.map(_touch, [dat.spec()]*4)
+    dat.close(unlink = True)
+    for rss, total in res:
+        assert total == 3*nind*nsite
+        assert rss < nind*nsite/4
+
+
+def test_acc():
+    pvs = [0.01, 0.05, 0.99, 0.001, 1e-18, 0.3]
+    acc = comb_acc(pvs[:2])
+    acc.update(pvs[2:4])
+    acc.merge(comb_acc(pvs[4:]))
+    assert acc.count == 6
+    assert acc.cct() == pytest.approx(cct(pvs))
+    assert acc.mcm() == pytest.approx(mcm(pvs))
+    assert acc.cmc() == pytest.approx(cmc(pvs))
+    assert comb_acc([0.01, 0.05, 0.10, 0.53], [2, 2, 2, 2]).cct() == pytest.approx(cct([0.01, 0.05, 0.10, 0.53]))
+
+
+def test_acc2():
+    assert comb_acc([0, 0.05, 0.01, 0.99]).cct() == 0
+    assert comb_acc([0.04, 0.001]).update([1]).cct() == 1
+    assert comb_acc([0.01, 0]).merge(comb_acc([1])).cct() == "Error: cannot have both 0 and 1 p-values!"
+    assert comb_acc([0.01, 0.05, 'a']).cct() == cct([0.01, 0.05, 'a'])
+    assert comb_acc([0.01, 1.2, 0.09]).mcm() == cct([0.01, 1.2, 0.09])
+    assert comb_acc([0.01, 0.05, 0.99], [1,2]).cct() == "Error: weights and pvlaues should be same length!"
+    assert comb_acc([0.01, 0.05, 0.99], [-1, 2, 3]).cct() == "Error: All the weights must be positive!"
+
+
+def test_update_both(tmp_path):
+    drop = [ l.split()[0] for l in open("map.txt") if l.split()[1] == "sp3" ][:2]
+    infile, mapfile, nind = _subset(tmp_path, drop)
+    res = comb_indiv(infile, mapfile, "out", nind, 4, 50000, remove_amb_site = "both")
+    res2 = update(res, "data.txt", "map.txt")
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, remove_amb_site = "both")
+    assert res2.all_sites.p_value == pytest.approx(res3.all_sites.p_value)
+    assert res2.unamb_sites.p_value == pytest.approx(res3.unamb_sites.p_value)
+    assert update(1, "data.txt", "map.txt") == "Error: The previous result does not keep the individual tests!"
+
+
+def test_species_both():
+    res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, alpha = 0.10, remove_amb_site = "both")
+    res1 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, alpha = 0.10)
+    res2 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, alpha = 0.10, remove_amb_site = True)
+    assert res.all_sites.p_value == pytest.approx(res1.p_value)
+    assert res.unamb_sites.p_value == pytest.approx(res2.p_value)
+    assert np.allclose(res.unamb_sites.tested["Z_score"], res2.tested["Z_score"])
+
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, sus_hyb=['sp1'], remove_amb_site = "both", nproc = 2)
+    res4 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, sus_hyb=['sp1'])
+    assert res3.all_sites.p_value == pytest.approx(res4.p_value)
+    assert np.allclose(res3.all_sites.tested["Z_score"], res4.tested["Z_score"])
+
+def test_species_outgroups():
+    res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, outgroups = ["out", "sp3"])
+    res1 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+    res2 = comb_species("data.txt", "map.txt", "sp3", 16, 4, 50000)
+    assert res["out"].p_value == pytest.approx(res1.p_value)
+    assert res["sp3"].p_value == pytest.approx(res2.p_value)
+    assert np.allclose(res["sp3"].tested["Z_score"], res2.tested["Z_score"])
+
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, sus_hyb = ['sp1'], outgroups = ["out", "sp3"], nproc = 2)
+    res4 = comb_indiv("data.txt", "map.txt", "sp3", 16, 4, 50000, sus_hyb = ['sp1'])
+    assert res3["sp3"].p_value == pytest.approx(res4.p_value)
+    assert comb_species("data.txt", "map.txt", "out", 16, 4, 50000, outgroups = ["sp9"]) == "Error: The outgroup sp9 is not in the map file!"
+
+@pytest.mark.skipif(sitepat.count_quads == None, reason = "the extension is not built")
+def test_outgroups_time(tmp_path):
+    ## one pass for two outgroups is not slower than two runs of phyde, on
+    ## sites that are almost all distinct
+    infile = _random_data(tmp_path, 200000)
+    t = time.perf_counter()
+    res = comb_indiv(infile, "map.txt", "out", 16, 4, 200000, outgroups = ["out", "sp3"])
+    t1 = time.perf_counter()
+    res1 = comb_indiv(infile, "map.txt", "out", 16, 4, 200000)
+    res2 = comb_indiv(infile, "map.txt", "sp3", 16, 4, 200000)
+    t2 = time.perf_counter()
+    assert res["sp3"].p_value == pytest.approx(res2.p_value)
+    assert t1 - t < 1.5*(t2 - t1)
+
+def test_species_approx():
+    res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, approx = 50000)
+    res1 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+    assert res.estimate.p_value == pytest.approx(res1.p_value)
+    assert res.p_band[0] == pytest.approx(res.p_band[1])
+    assert res.stable == True
+
+    ## 20 sites can not hold 10 sites of each of the AABB, ABAB and ABBA
+    ## patterns, so the subset is always refined
+    res2 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, approx = 20, seed = 2)
+    res3 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, approx = 20, seed = 2)
+    assert res2.sites > 20
+    assert res2.p_band == res3.p_band
+    assert res2.p_band[0] <= res2.estimate.p_value <= res2.p_band[1]
+    assert (res2.estimate.p_value <= 0.05) == (res1.p_value <= 0.05)
+
+def test_approx_null(tmp_path):
+    ## no hybrid signal, in 8 taxa: the subset must not find one among the
+    ## 105 triples
+    mapfile = _random_map(tmp_path, 7)
+    infile = _random_data(tmp_path, 50000, mapfile)
+    for comb in [comb_species, comb_indiv]:
+        res = comb(infile, mapfile, "out", 16, 8, 50000)
+        res2 = comb(infile, mapfile, "out", 16, 8, 50000, approx = 1000)
+        assert res.p_value > 0.05
+        assert res2.estimate.p_value > 0.05
+        assert res2.stable == False or res2.p_band[0] > 0.05
+
+def test_pipeline(tmp_path):
+    res = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, remove_amb_site = "both", pipeline = True)
+    res1 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, remove_amb_site = "both")
+    assert res.all_sites.p_value == res1.all_sites.p_value
+    assert res.unamb_sites.tested.equals(res1.unamb_sites.tested)
+
+    res2 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, sus_hyb = ['sp1'], pipeline = True, nproc = 2)
+    res3 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, sus_hyb = ['sp1'], nproc = 2)
+    assert res2.p_value == res3.p_value
+    assert res2.tested.equals(res3.tested)
+
+    res4 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, outgroups = ["out", "sp3"], pipeline = True)
+    res5 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, outgroups = ["out", "sp3"])
+    assert res4["sp3"].tested.equals(res5["sp3"].tested)
+
+    ## the default path (phyde) matches to rounding
+    res6 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, pipeline = True)
+    res7 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+    assert res6.p_value == pytest.approx(res7.p_value, rel = 1e-9)
+    assert np.allclose(res6.tested["Z_score"], res7.tested["Z_score"], rtol = 1e-9, atol = 0)
+    assert np.allclose(res6.tested["Gamma"], res7.tested["Gamma"], rtol = 1e-9, atol = 0)
+    res8 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, pipeline = True)
+    res9 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000)
+    assert res8.p_value == pytest.approx(res9.p_value, rel = 1e-9)
+    assert np.allclose(res8.tested["Z_score"], res9.tested["Z_score"], rtol = 1e-9, atol = 0)
+    with pytest.raises(ValueError):
+        comb_species("data.txt", "map.txt", "out", 16, 4, 40000, pipeline = True)
+
+    ## exactly, without the three-base codes (B, D, H, V)
+    if sitepat.count_quads != None:
+        infile = str(tmp_path / "data_nobdhv.txt")
+        with open("data.txt") as f, open(infile, "w") as g:
+            g.write(re.sub("[BDHV]", "N", f.read()))
+        res10 = comb_indiv(infile, "map.txt", "out", 16, 4, 50000, pipeline = True)
+        res11 = comb_indiv(infile, "map.txt", "out", 16, 4, 50000)
+        assert res10.p_value == res11.p_value
+        assert res10.tested.equals(res11.tested)
+
+def test_top_k():
+    res = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000, top_k = 3)
+    res1 = comb_indiv("data.txt", "map.txt", "out", 16, 4, 50000)
+    assert res.p_value == res1.p_value
+    assert len(res.detailed) == 3
+    assert res.tested is None
+    best = res1.tested[(res1.tested["Gamma"] >= 0) & (res1.tested["Gamma"] <= 1)]
+    best = best.sort_values(["P_value", "Z_score"], ascending=[True, False]).head(3)
+    assert res.detailed["Hybrid"].tolist() == best["Hybrid"].tolist()
+
+    res2 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000, top_k = 100)
+    res3 = comb_species("data.txt", "map.txt", "out", 16, 4, 50000)
+    assert len(res2.detailed) == len(res3.tested)
+    assert res2.detailed["P_value"].is_monotonic_increasing
+    assert comb_species("data.txt", "map.txt", "out", 16, 4, 50000, top_k = 0) == "Error: top_k must be a positive integer and can not be used with group_by!"
+    assert update(res2, "data.txt", "map.txt") == "Error: The previous result does not keep the individual tests!"
+
+def test_shared_attach():
+    ## a process with its own resource tracker leaves the block to its
+    ## creator when it exits
+    dat = read_sites("data.txt", "map.txt", "out", 16, 4, 50000, shared = True)
+    try:
+        code = "import sys, pickle; from pyghdet import sitepat; sitepat.site_data.attach(pickle.loads(sys.stdin.buffer.read())).close()"
+        env = dict(os.environ, PYTHONPATH = os.path.dirname(os.path.dirname(sitepat.__file__)))
+        run = subprocess.run([sys.executable, "-c", code], input = pickle.dumps(dat.spec()), capture_output = True, env = env)
+        assert run.returncode == 0 and b"leaked" not in run.stderr
+        dat2 = sitepat.site_data.attach(dat.spec())
+        assert (dat2.mat == dat.mat).all()
+        dat2.close()
+    finally:
+        dat.close(unlink = True)
+
+def test_shared_error():
+    before = set(os.listdir("/dev/shm"))
+    with pytest.raises(ValueError):
+        comb_species("data.txt", "map.txt", "out", 16, 4, 40000, nproc = 2)
+    with pytest.raises(ValueError):
+        comb_species("data.txt", "map.txt", "out", 12, 4, 50000, nproc = 2)
+    assert set(os.listdir("/dev/shm")) == before
+
+def test_acc_empty(tmp_path):
+    assert comb_acc().cct() == "Error: There is no p-value to combine!"
+    assert comb_acc().mcm() == "Error: There is no p-value to combine!"
+    assert comb_acc().cmc() == "Error: There is no p-value to combine!"
+
+    ## two species and the outgroup: no triple to test
+    infile, mapfile, nind = _subset(tmp_path, [ f"sp3_{i}" for i in range(4) ])
+    assert comb_species(infile, mapfile, "out", nind, 3, 50000) == "Error: There is no p-value to combine!"
+    assert comb_species(infile, mapfile, "out", nind, 3, 50000, approx = 100) == "Error: There is no p-value to combine!"